@@ -7,7 +7,11 @@ import contextlib
 import os
 import random
 import time
+import traceback
 from functools import partial
+from io import BytesIO
+from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Union
@@ -17,6 +21,14 @@ import regex
 import requests
 import httpx
 
+from metrics import METRICS
+
+try:
+    import h2  # noqa: F401 (httpx only speaks HTTP/2 when h2 is installed)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
 class ImageCreatorException(Exception):
     pass
 
@@ -39,6 +51,20 @@ HEADERS = {
     "x-forwarded-for": FORWARDED_IP,
 }
 
+POOL_LIMITS = httpx.Limits(
+    max_connections=20,
+    max_keepalive_connections=10,
+    keepalive_expiry=120,
+)
+POOL_IDLE_TIMEOUT = 900
+DOWNLOAD_CONCURRENCY = 4
+POLL_TIMEOUT = 200
+POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 5
+POLL_BACKOFF = 1.3
+POLL_JITTER = 0.2
+IMAGE_SRC = regex.compile(r'src="([^"]+)"')
+
 # Error messages
 error_timeout = "Your request has timed out."
 error_redirect = "Redirect failed"
@@ -63,6 +89,20 @@ def debug(debug_file, text_var):
         f.write("\n")
 
 
+def is_placeholder(head: bytes) -> bool:
+    """Checks the first bytes of a download for svg/html instead of image data"""
+    head = head.lstrip()[:64].lower()
+    return head.startswith((b"<svg", b"<?xml", b"<!doctype", b"<html"))
+
+
+def image_extension(body: bytes) -> str:
+    if body.startswith(b"\x89PNG"):
+        return "png"
+    if body[:4] == b"RIFF" and body[8:12] == b"WEBP":
+        return "webp"
+    return "jpeg"
+
+
 class ImageGen:
     """
     Image generation by Microsoft Bing
@@ -248,6 +288,90 @@ class ImageGen:
         
         return filenames
 
+class ClientPool:
+    """
+    Long-lived httpx clients keyed by auth cookie, so repeated generations
+    reuse warm connections to Bing instead of reconnecting every time
+    Optional Parameters:
+        idle_timeout: float
+        limits: httpx.Limits
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        limits: httpx.Limits = POOL_LIMITS,
+    ) -> None:
+        self.idle_timeout = idle_timeout
+        self.limits = limits
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._last_used: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {}
+        self._reaper: Union[asyncio.Task, None] = None
+
+    def _new_client(self, auth_cookie: str) -> httpx.AsyncClient:
+        session = httpx.AsyncClient(
+            headers=HEADERS,
+            trust_env=True,
+            http2=HTTP2,
+            limits=self.limits,
+        )
+        session.cookies.update({"_U": auth_cookie})
+        return session
+
+    def start(self, cookies: List[str] = None) -> None:
+        """
+        Opens a client for every cookie up front and starts idle eviction
+        """
+        for cookie in cookies or []:
+            self._get(cookie)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    def _get(self, auth_cookie: str) -> httpx.AsyncClient:
+        session = self._clients.get(auth_cookie)
+        if session is None or session.is_closed:
+            session = self._new_client(auth_cookie)
+            self._clients[auth_cookie] = session
+        self._last_used[auth_cookie] = time.monotonic()
+        return session
+
+    @contextlib.asynccontextmanager
+    async def client(self, auth_cookie: str):
+        """
+        Borrows the client for a cookie, keeping it safe from eviction while in use
+        """
+        session = self._get(auth_cookie)
+        self._in_use[auth_cookie] = self._in_use.get(auth_cookie, 0) + 1
+        try:
+            yield session
+        finally:
+            self._in_use[auth_cookie] -= 1
+            self._last_used[auth_cookie] = time.monotonic()
+
+    async def _reap(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            for cookie in list(self._clients):
+                if self._in_use.get(cookie):
+                    continue
+                if now - self._last_used.get(cookie, now) < self.idle_timeout:
+                    continue
+                session = self._clients.pop(cookie)
+                self._last_used.pop(cookie, None)
+                await session.aclose()
+
+    async def aclose(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        clients = list(self._clients.values())
+        self._clients.clear()
+        self._last_used.clear()
+        await asyncio.gather(*(session.aclose() for session in clients))
+
+
 class ImageGenAsync:
     """
     Image generation by Microsoft Bing
@@ -257,6 +381,13 @@ class ImageGenAsync:
         debug_file: str
         quiet: bool
         all_cookies: list[dict]
+        session: httpx.AsyncClient (shared client, left open on exit)
+        timeout: float (overall polling deadline in seconds)
+        poll_interval: float
+        max_poll_interval: float
+        poll_backoff: float
+        poll_jitter: float
+        progress: Callable[[str], Any] ("queued", "rendering", "downloading")
     """
 
     def __init__(
@@ -265,20 +396,36 @@ class ImageGenAsync:
         debug_file: Union[str, None] = None,
         quiet: bool = False,
         all_cookies: List[Dict] = None,
+        session: httpx.AsyncClient = None,
+        timeout: float = POLL_TIMEOUT,
+        poll_interval: float = POLL_INTERVAL,
+        max_poll_interval: float = MAX_POLL_INTERVAL,
+        poll_backoff: float = POLL_BACKOFF,
+        poll_jitter: float = POLL_JITTER,
+        progress: Callable[[str], Any] = None,
     ) -> None:
-        if auth_cookie is None and not all_cookies:
-            raise ImageCreatorException("No auth cookie provided")
-        self.session = httpx.AsyncClient(
-            headers=HEADERS,
-            trust_env=True,
-        )
-        if auth_cookie:
-            self.session.cookies.update({"_U": auth_cookie})
-        if all_cookies:
-            for cookie in all_cookies:
-                self.session.cookies.update(
-                    {cookie["name"]: cookie["value"]},
-                )
+        self._owns_session = session is None
+        if session is None:
+            if auth_cookie is None and not all_cookies:
+                raise ImageCreatorException("No auth cookie provided")
+            session = httpx.AsyncClient(
+                headers=HEADERS,
+                trust_env=True,
+            )
+            if auth_cookie:
+                session.cookies.update({"_U": auth_cookie})
+            if all_cookies:
+                for cookie in all_cookies:
+                    session.cookies.update(
+                        {cookie["name"]: cookie["value"]},
+                    )
+        self.session = session
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.poll_jitter = poll_jitter
+        self.progress = progress
         self.quiet = quiet
         self.debug_file = debug_file
         if self.debug_file:
@@ -288,7 +435,8 @@ class ImageGenAsync:
         return self
 
     async def __aexit__(self, *excinfo) -> None:
-        await self.session.aclose()
+        if self._owns_session:
+            await self.session.aclose()
 
     async def get_images(self, prompt: str) -> list:
         """
@@ -302,11 +450,12 @@ class ImageGenAsync:
         # https://www.bing.com/images/create?q=<PROMPT>&rt=3&FORM=GENCRE
         url = f"{BING_URL}/images/create?q={url_encoded_prompt}&rt=3&FORM=GENCRE"
         payload = f"q={url_encoded_prompt}&qs=ds"
-        response = await self.session.post(
-            url,
-            follow_redirects=False,
-            data=payload,
-        )
+        with METRICS.timer("bing_phase_seconds", phase="create"):
+            response = await self.session.post(
+                url,
+                follow_redirects=False,
+                data=payload,
+            )
         content = response.text
         if "this prompt has been blocked" in content.lower():
             raise ImageCreatorException(
@@ -315,11 +464,12 @@ class ImageGenAsync:
         if response.status_code != 302:
             # if rt4 fails, try rt3
             url = f"{BING_URL}/images/create?q={url_encoded_prompt}&rt=4&FORM=GENCRE"
-            response = await self.session.post(
-                url,
-                follow_redirects=False,
-                timeout=200,
-            )
+            with METRICS.timer("bing_phase_seconds", phase="create"):
+                response = await self.session.post(
+                    url,
+                    follow_redirects=False,
+                    timeout=200,
+                )
             if response.status_code != 302:
                 print(f"ERROR: {response.text}")
                 with open("redirect_debug.txt", "w") as f:
@@ -328,31 +478,22 @@ class ImageGenAsync:
         # Get redirect URL
         redirect_url = response.headers["Location"].replace("&nfy=1", "")
         request_id = redirect_url.split("id=")[-1]
-        await self.session.get(f"{BING_URL}{redirect_url}")
+        with METRICS.timer("bing_phase_seconds", phase="redirect"):
+            await self.session.get(f"{BING_URL}{redirect_url}")
         # https://www.bing.com/images/create/async/results/{ID}?q={PROMPT}
         polling_url = f"{BING_URL}/images/create/async/results/{request_id}?q={url_encoded_prompt}"
+        await self._report("queued")
         # Poll for results
         if not self.quiet:
-            print("Waiting for results...")
-        while True:
-            if not self.quiet:
-                print(".", end="", flush=True)
-            # By default, timeout is 300s, change as needed
-            response = await self.session.get(polling_url)
-            if response.status_code != 200:
-                raise ImageCreatorException("Could not get results")
-            content = response.text
-            if content and content.find("errorMessage") == -1:
-                break
-
-            await asyncio.sleep(1)
-            continue
+            print(wait_message)
+        with METRICS.timer("bing_phase_seconds", phase="poll"):
+            content = await self._poll(polling_url)
         # Use regex to search for src=""
-        image_links = regex.findall(r'src="([^"]+)"', content)
+        image_links = IMAGE_SRC.findall(content)
         # Remove size limit
         normal_image_links = [link.split("?w=")[0] for link in image_links]
         # Remove duplicates
-        normal_image_links = list(set(normal_image_links))
+        normal_image_links = list(dict.fromkeys(normal_image_links))
 
         # Bad images
         bad_images = [
@@ -367,72 +508,172 @@ class ImageGenAsync:
             raise ImageCreatorException("No images")
         return normal_image_links
 
-    async def save_images(
+    async def _report(self, stage: str) -> None:
+        if self.progress is None:
+            return
+        # Progress is cosmetic; a failed status edit mustn't sink the generation
+        try:
+            result = self.progress(stage)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            traceback.print_exc()
+
+    async def _poll(self, polling_url: str) -> str:
+        """
+        Polls the results page with jittered exponential backoff until the
+        images are ready or the deadline passes
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        interval = self.poll_interval
+        rendering = False
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                if self.debug_file:
+                    self.debug(f"ERROR: {error_timeout}")
+                raise ImageCreatorException(error_timeout)
+            METRICS.increment("bing_poll_requests")
+            try:
+                response = await self.session.get(polling_url, timeout=remaining)
+            except httpx.TimeoutException as timeout_exception:
+                raise ImageCreatorException(error_timeout) from timeout_exception
+            if response.status_code != 200:
+                raise ImageCreatorException(error_noresults)
+            content = response.text
+            if content and content.find("errorMessage") == -1:
+                return content
+            if not rendering:
+                rendering = True
+                await self._report("rendering")
+            delay = interval * random.uniform(1 - self.poll_jitter, 1 + self.poll_jitter)
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            interval = min(interval * self.poll_backoff, self.max_poll_interval)
+
+    async def _download(
+        self,
+        link: str,
+        semaphore: asyncio.Semaphore,
+    ) -> Union[bytes, None]:
+        async with semaphore:
+            with METRICS.timer("bing_phase_seconds", phase="download"):
+                async with self.session.stream("GET", link) as response:
+                    if response.status_code != 200:
+                        raise ImageCreatorException("Could not download image")
+                    buffer = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        if not buffer and is_placeholder(chunk):
+                            # Bing serves an svg stand-in for filtered images
+                            return None
+                        buffer.extend(chunk)
+        return bytes(buffer)
+
+    async def download_images(
         self,
         links: list,
-        output_dir: str,
         download_count: int,
-        file_name: str = None,
-    ) -> None:
+        concurrency: int = DOWNLOAD_CONCURRENCY,
+    ) -> List[BytesIO]:
         """
-        Saves images to output directory
+        Downloads images concurrently into memory, skipping placeholders
+        Parameters:
+            links: list[str]
+            download_count: int
+        Optional Parameters:
+            concurrency: int
         """
-
         if self.debug_file:
             self.debug(download_message)
         if not self.quiet:
             print(download_message)
-        with contextlib.suppress(FileExistsError):
-            os.mkdir(output_dir)
+        await self._report("downloading")
+        semaphore = asyncio.Semaphore(concurrency)
         try:
-            fn = f"{file_name}_" if file_name else ""
-            jpeg_index = len(os.listdir("images"))
-            filenames = []
-            for link in links[:download_count]:
-                while os.path.exists(
-                    os.path.join(output_dir, f"{fn}{jpeg_index}.jpeg")
-                ):
-                    jpeg_index += 1
-                response = await self.session.get(link)
-                if response.status_code != 200:
-                    raise ImageCreatorException("Could not download image")
-                # save response to file
-                file_name = os.path.join(output_dir, f"{fn}{jpeg_index}.jpeg")
-                filenames.append(file_name)
-                with open(
-                    os.path.join(output_dir, f"{fn}{jpeg_index}.jpeg"), "wb"
-                ) as output_file:
-                    output_file.write(response.content)
-                jpeg_index += 1
+            bodies = await asyncio.gather(
+                *(self._download(link, semaphore) for link in links[:download_count])
+            )
         except httpx.InvalidURL as url_exception:
             raise ImageCreatorException(
                 "Inappropriate contents found in the generated images. Please try again or try another prompt.",
             ) from url_exception
+        images = []
+        for body in bodies:
+            if body is None:
+                continue
+            image = BytesIO(body)
+            image.name = f"{len(images)}.{image_extension(body)}"
+            images.append(image)
+        if not images:
+            raise ImageCreatorException(error_bad_images)
+        return images
+
+    async def save_images(
+        self,
+        links: list,
+        output_dir: str,
+        download_count: int,
+        file_name: str = None,
+    ) -> None:
+        """
+        Saves images to output directory
+        """
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(output_dir)
+        fn = f"{file_name}_" if file_name else ""
+        filenames = []
+        for image in await self.download_images(links, download_count):
+            path = os.path.join(output_dir, f"{fn}{image.name}")
+            with open(path, "wb") as output_file:
+                output_file.write(image.getbuffer())
+            filenames.append(path)
         return filenames
 
 
 async def async_image_gen(
     prompt: str,
     download_count: int,
-    output_dir: str,
     u_cookie=None,
     debug_file=None,
     quiet=False,
     all_cookies=None,
+    pool: ClientPool = None,
+    progress: Callable[[str], Any] = None,
+    **polling,
 ):
+    """
+    polling is passed to ImageGenAsync: timeout, poll_interval,
+    max_poll_interval, poll_backoff and poll_jitter
+    """
+    if pool is not None and u_cookie is not None and not all_cookies:
+        async with pool.client(u_cookie) as session:
+            image_generator = ImageGenAsync(
+                debug_file=debug_file,
+                quiet=quiet,
+                session=session,
+                progress=progress,
+                **polling,
+            )
+            links = await image_generator.get_images(prompt)
+            return await image_generator.download_images(links, download_count)
     async with ImageGenAsync(
         u_cookie,
         debug_file=debug_file,
         quiet=quiet,
         all_cookies=all_cookies,
+        progress=progress,
+        **polling,
     ) as image_generator:
-        images = await image_generator.get_images(prompt)
-        filenames = await image_generator.save_images(
-            images, output_dir=output_dir, download_count=download_count
-        )
-        return filenames
+        links = await image_generator.get_images(prompt)
+        return await image_generator.download_images(links, download_count)
 
-async def generate_image(prompt: str, output_dir: str, cookie: str, n: int = 4, quiet: bool = False):
+async def generate_image(prompt: str, cookie: str, n: int = 4, quiet: bool = False, pool: ClientPool = None,
+                         progress: Callable[[str], Any] = None, **polling) -> List[BytesIO]:
+    """
+    Generates n images with a Bing cookie. polling overrides the results
+    page polling: timeout, poll_interval, max_poll_interval, poll_backoff
+    and poll_jitter (see ImageGenAsync)
+    """
 
     if cookie is None:
         raise ImageCreatorException("Could not find auth cookie")
@@ -451,6 +692,6 @@ async def generate_image(prompt: str, output_dir: str, cookie: str, n: int = 4,
     #     download_count=n,
     # )
 
-    filenames = await async_image_gen(prompt, n, output_dir, cookie, quiet=quiet)
+    images = await async_image_gen(prompt, n, cookie, quiet=quiet, pool=pool, progress=progress, **polling)
 
-    return filenames
+    return images
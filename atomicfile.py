@@ -0,0 +1,32 @@
+"""
+Crash-safe file writes for the bot's state files
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def write_text(path: str, text: str) -> None:
+    """
+    Writes to a uniquely named temporary file next to path and renames it
+    over path, so readers and a restart after a crash only ever see the old
+    or the new file, and concurrent writers never share a temporary file
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        # mkstemp makes the file owner-only; keep the usual permissions for things like metrics.prom
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def write_json(path: str, data: Any) -> None:
+    write_text(path, json.dumps(data))
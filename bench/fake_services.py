@@ -0,0 +1,174 @@
+"""
+Local stand-ins for Bing Image Creator and the OpenAI images endpoint
+
+Run on its own with
+    python -m bench.fake_services --port 8080 --render-delay 5
+and point the bot at it with BING_URL=http://127.0.0.1:8080. Prompts
+containing "blocked" are rejected like Bing's content filter, prompts
+containing "redirectfail" never get their 302 (as with an exhausted
+cookie), and prompts containing "placeholder" get an svg in place of
+their first image.
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import struct
+import time
+import uuid
+from io import BytesIO
+from typing import Dict
+
+from aiohttp import web
+
+RENDER_DELAY = 5.0
+IMAGE_BYTES = 200 * 1024
+DALLE_DELAY = 8.0
+IMAGES_PER_JOB = 4
+IMAGE_SIDE = 1024
+PLACEHOLDER = b'<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"></svg>'
+
+
+def fake_jpeg(size: int) -> bytes:
+    """
+    A decodable photo-like JPEG padded with comment segments to about size
+    bytes, or just a JPEG header and noise when PIL isn't installed
+    """
+    try:
+        from PIL import Image
+        from PIL import ImageFilter
+    except ImportError:
+        # Starts like a JPEG so the bot's sniffing treats it as an image
+        return b"\xff\xd8\xff\xe0" + os.urandom(max(size - 4, 0))
+    gradient = Image.linear_gradient("L").resize((IMAGE_SIDE, IMAGE_SIDE))
+    noise = Image.effect_noise((IMAGE_SIDE, IMAGE_SIDE), 12).filter(ImageFilter.GaussianBlur(1))
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(90)))
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=92)
+    body = out.getvalue()
+    padding = b""
+    missing = size - len(body)
+    while missing > 4:
+        chunk = min(missing - 4, 65533)
+        padding += b"\xff\xfe" + struct.pack(">H", chunk + 2) + b"\0" * chunk
+        missing -= chunk + 4
+    return body[:2] + padding + body[2:]
+
+
+class FakeState:
+    """Jobs in flight and request counters for one fake server"""
+
+    def __init__(self, render_delay: float, image_bytes: int, dalle_delay: float) -> None:
+        self.render_delay = render_delay
+        self.image_bytes = image_bytes
+        self.dalle_delay = dalle_delay
+        self.jobs: Dict[str, Dict] = {}
+        self.requests: Dict[str, int] = {}
+        self.connections = set()
+        self.image = fake_jpeg(image_bytes)
+
+    def count(self, request: web.Request, route: str) -> None:
+        self.requests[route] = self.requests.get(route, 0) + 1
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        if peer is not None:
+            self.connections.add(peer)
+
+
+async def create(request: web.Request) -> web.Response:
+    state: FakeState = request.app["state"]
+    state.count(request, "create")
+    prompt = request.query.get("q", "")
+    if "blocked" in prompt:
+        return web.Response(text="<html>This prompt has been blocked</html>")
+    if "redirectfail" in prompt:
+        return web.Response(text="<html>Sign in</html>")
+    job = uuid.uuid4().hex
+    state.jobs[job] = {"created": time.monotonic(), "prompt": prompt}
+    location = f"/images/create?q={request.query.get('q', '')}&rt=4&FORM=GENCRE&id={job}&nfy=1"
+    return web.Response(status=302, headers={"Location": location})
+
+
+async def redirect(request: web.Request) -> web.Response:
+    request.app["state"].count(request, "redirect")
+    return web.Response(text="<html>Creating...</html>")
+
+
+async def results(request: web.Request) -> web.Response:
+    state: FakeState = request.app["state"]
+    state.count(request, "poll")
+    job = state.jobs.get(request.match_info["job"])
+    if job is None:
+        return web.Response(status=404)
+    if time.monotonic() - job["created"] < state.render_delay:
+        return web.Response(text="")
+    host = f"http://{request.host}"
+    images = "".join(
+        f'<img src="{host}/img/{request.match_info["job"]}/{i}.jpg?w=270&h=270">' for i in range(IMAGES_PER_JOB)
+    )
+    return web.Response(text=f"<div>{images}</div>")
+
+
+async def image(request: web.Request) -> web.Response:
+    state: FakeState = request.app["state"]
+    state.count(request, "image")
+    job = state.jobs.get(request.match_info["job"])
+    if job is None:
+        return web.Response(status=404)
+    if "placeholder" in job["prompt"] and request.match_info["index"] == "0":
+        return web.Response(body=PLACEHOLDER, content_type="image/svg+xml")
+    return web.Response(body=state.image, content_type="image/jpeg")
+
+
+async def dalle(request: web.Request) -> web.Response:
+    state: FakeState = request.app["state"]
+    state.count(request, "dalle")
+    body = await request.json()
+    await asyncio.sleep(state.dalle_delay)
+    if "blocked" in body.get("prompt", ""):
+        error = {"error": {"message": "Your request was rejected by the safety system.", "type": "invalid_request_error"}}
+        return web.json_response(error, status=400)
+    data = [{"b64_json": base64.b64encode(state.image).decode("ascii")} for _ in range(body.get("n", 1))]
+    return web.json_response({"created": int(time.time()), "data": data})
+
+
+def create_app(render_delay: float = RENDER_DELAY, image_bytes: int = IMAGE_BYTES,
+               dalle_delay: float = DALLE_DELAY) -> web.Application:
+    app = web.Application()
+    app["state"] = FakeState(render_delay, image_bytes, dalle_delay)
+    app.router.add_post("/images/create", create)
+    app.router.add_get("/images/create", redirect)
+    app.router.add_get("/images/create/async/results/{job}", results)
+    app.router.add_get("/img/{job}/{index}.jpg", image)
+    app.router.add_post("/v1/images/generations", dalle)
+    return app
+
+
+async def start(host: str = "127.0.0.1", port: int = 0, **options):
+    """Starts the fake services, returning (runner, base url, state)"""
+    app = create_app(**options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}", app["state"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--render-delay", type=float, default=RENDER_DELAY)
+    parser.add_argument("--image-bytes", type=int, default=IMAGE_BYTES)
+    parser.add_argument("--dalle-delay", type=float, default=DALLE_DELAY)
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.render_delay, args.image_bytes, args.dalle_delay),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
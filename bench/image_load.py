@@ -0,0 +1,133 @@
+"""
+Load benchmark for the /image pipeline against the local fake services
+
+    python -m bench.image_load --requests 40 --concurrency 10 --render-delay 3
+
+Runs N generate_image calls (or DALL-E calls with --dalle) at the given
+concurrency and reports throughput, latency percentiles, client sockets,
+server-side connections and peak memory. --no-pool measures the old
+one-client-per-call behaviour for comparison.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from bench import fake_services
+from metrics import percentile
+
+
+def open_sockets() -> int:
+    """Sockets held by this process, from /proc where available"""
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        return -1
+    count = 0
+    for fd in os.listdir(fd_dir):
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith("socket:"):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+async def sample_sockets(peak: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], open_sockets())
+        await asyncio.sleep(0.05)
+
+
+async def run(args) -> None:
+    runner, url, state = await fake_services.start(
+        render_delay=args.render_delay,
+        image_bytes=args.image_bytes,
+        dalle_delay=args.dalle_delay,
+    )
+    # BingImageCreator reads BING_URL at import, so it has to come after the server
+    os.environ["BING_URL"] = url
+    sys.modules.pop("BingImageCreator", None)
+    import BingImageCreator
+    import cookies
+    import openai
+
+    pool = None if args.no_pool else BingImageCreator.ClientPool()
+    scheduler = cookies.CookieScheduler([f"cookie-{i}" for i in range(args.cookies)], hedge=args.hedge)
+    dalle = openai.AsyncOpenAI(api_key="bench", base_url=f"{url}/v1")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = {}
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if args.dalle:
+                    response = await dalle.images.generate(
+                        model="dall-e-2", prompt=f"{args.prompt} {i}", n=1, response_format="b64_json"
+                    )
+                    assert response.data[0].b64_json
+                else:
+                    async def generate(cookie):
+                        return await BingImageCreator.generate_image(
+                            f"{args.prompt} {i}", cookie, args.number, quiet=True, pool=pool
+                        )
+                    await scheduler.run(generate)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    peak_sockets = [open_sockets()]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_sockets(peak_sockets, stop))
+    tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    await sampler
+    if pool is not None:
+        await pool.aclose()
+    await dalle.close()
+    await runner.cleanup()
+
+    print(f"mode:            {'dalle' if args.dalle else 'bing'} ({'no pool' if args.no_pool else 'pooled'})")
+    print(f"requests:        {args.requests} at concurrency {args.concurrency}")
+    print(f"completed:       {len(latencies)}  errors: {errors or 0}")
+    print(f"wall time:       {elapsed:.2f}s  throughput: {len(latencies) / elapsed:.2f} req/s")
+    print(
+        f"latency:         p50 {percentile(latencies, 0.5):.2f}s  p95 {percentile(latencies, 0.95):.2f}s"
+        f"  p99 {percentile(latencies, 0.99):.2f}s  max {max(latencies, default=0):.2f}s"
+    )
+    print(f"server requests: {state.requests}")
+    print(f"tcp connections: {len(state.connections)} accepted by the fake server")
+    print(f"peak sockets:    {peak_sockets[0]} open in this process")
+    print(f"peak memory:     {peak_traced / 1024 / 1024:.1f} MiB traced, "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB max RSS")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--number", type=int, default=4, help="images per request")
+    parser.add_argument("--prompt", default="a gnome riding a bicycle")
+    parser.add_argument("--cookies", type=int, default=1)
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--no-pool", action="store_true")
+    parser.add_argument("--dalle", action="store_true")
+    parser.add_argument("--render-delay", type=float, default=fake_services.RENDER_DELAY)
+    parser.add_argument("--image-bytes", type=int, default=fake_services.IMAGE_BYTES)
+    parser.add_argument("--dalle-delay", type=float, default=fake_services.DALLE_DELAY)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
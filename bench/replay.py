@@ -0,0 +1,425 @@
+"""
+Offline replay of bot.py slash commands with fake Discord objects
+
+    python -m bench.replay --concurrency 4 --max-block-ms 50
+    python -m bench.replay --script recorded.json
+
+Imports bot.py inside a scratch directory with a generated tokens.json,
+points Bing at bench.fake_services, stubs the OpenAI client, and drives the
+command callbacks directly with fake interactions. A script is a JSON list
+of steps such as
+
+    {"command": "respond", "args": {"message": "hi"}, "user": 1, "channel": 10, "repeat": 5}
+
+For every command it reports end-to-end handler latency, the time the
+handler itself held the event loop (sum and longest single step between
+awaits), and the worst loop lag seen while it was running. With
+--max-block-ms the run exits non-zero if any handler blocked the loop for
+longer than that in one step, so blocking I/O or SDK calls fail CI.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from types import SimpleNamespace
+from typing import Dict
+from typing import List
+
+from bench import fake_services
+from metrics import percentile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUILD_ID = 100
+ADMIN_GUILD_ID = 101
+WEREWOLF_GUILD_ID = 102
+QUOTE_CHANNEL_ID = 800
+WEREWOLF_CHANNEL_ID = 700
+DEBUG_CHANNEL_ID = 900
+GM_ROLE_ID = 5
+
+USERS = {1: "gnome", 2: "pip", 3: "bramble", 4: "thistle"}
+
+TOKENS = {
+    "nicknames": {str(uid): name.title() for uid, name in USERS.items()},
+    "guilds": [GUILD_ID],
+    "admin_guilds": [ADMIN_GUILD_ID],
+    "admins": [1],
+    "debug_channels": [DEBUG_CHANNEL_ID],
+    "bot_token": "replay",
+    "quote_channel": QUOTE_CHANNEL_ID,
+    "openai_key": "sk-replay",
+    "bing_cookie": ["replay-cookie-1", "replay-cookie-2"],
+    "werewolf_guild_id": WEREWOLF_GUILD_ID,
+    "gm_role_id": GM_ROLE_ID,
+    "gm_id": 1,
+    "werewolf_channel_id": WEREWOLF_CHANNEL_ID,
+}
+
+DEFAULT_SCRIPT = [
+    {"command": "respond", "args": {"message": "what should we eat tonight?"}, "repeat": 4},
+    {"command": "respond", "args": {"context_length": "-1"}, "repeat": 2},
+    {"command": "image", "args": {"prompt": "a gnome on a bicycle", "number": 4}, "repeat": 3},
+    {"command": "image", "args": {"prompt": "redirectfail gnome", "number": 1}, "repeat": 1},
+    {"command": "quote", "args": {}, "repeat": 2},
+    {"command": "mock", "args": {}, "repeat": 4},
+    {"command": "miles", "args": {"activity": "Running", "distance": 3.1}, "repeat": 6},
+    {"command": "miles", "args": {}, "repeat": 2},
+    {"command": "miles", "args": {"period": "week"}, "repeat": 2},
+    {"command": "poll", "args": {"message": "Lunch?", "option1": "tacos", "option2": "pho"}, "repeat": 2},
+    {"command": "lock", "args": {}, "channel": WEREWOLF_CHANNEL_ID, "repeat": 1},
+    {"command": "unlock", "args": {}, "channel": WEREWOLF_CHANNEL_ID, "repeat": 1},
+]
+
+_ids = itertools.count(1_000_000)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content: str) -> None:
+        self.id = next(_ids)
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.edited_at = None
+        self.reactions = []
+
+    async def add_reaction(self, emoji) -> None:
+        await asyncio.sleep(0)
+        self.reactions.append(emoji)
+
+    async def delete(self) -> None:
+        self.channel.messages = [m for m in self.channel.messages if m.id != self.id]
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, bot_user, rtt: float) -> None:
+        self.id = channel_id
+        self.bot_user = bot_user
+        self.rtt = rtt
+        self.messages: List[FakeMessage] = []
+        self.history_calls = 0
+
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        self.history_calls += 1
+        await asyncio.sleep(self.rtt)
+        messages = list(self.messages)
+        if before is not None:
+            messages = [m for m in messages if m.id < before.id]
+        if after is not None:
+            messages = [m for m in messages if m.id > after.id]
+        if oldest_first is None:
+            oldest_first = after is not None
+        if not oldest_first:
+            messages.reverse()
+        for message in messages[:limit]:
+            yield message
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.rtt)
+        message = FakeMessage(self, self.bot_user, content or "")
+        self.messages.append(message)
+        return message
+
+    async def set_permissions(self, *args, **kwargs) -> None:
+        await asyncio.sleep(self.rtt)
+
+    async def delete_messages(self, messages) -> None:
+        await asyncio.sleep(self.rtt)
+        ids = {m.id for m in messages}
+        self.messages = [m for m in self.messages if m.id not in ids]
+
+
+class FakeResponse:
+    def __init__(self, interaction) -> None:
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self, content=None) -> None:
+        if self._done:
+            raise RuntimeError("interaction already responded to")
+        self._done = True
+        await asyncio.sleep(self.interaction.rtt)
+        self.interaction.original = FakeMessage(self.interaction.channel, self.interaction.bot_user, content or "")
+
+    async def defer(self, **kwargs) -> None:
+        await self._respond()
+
+    async def send_message(self, content=None, **kwargs) -> None:
+        await self._respond(content)
+
+    async def pong(self) -> None:
+        await self._respond()
+
+
+class FakeFollowup:
+    def __init__(self, interaction) -> None:
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.interaction.rtt)
+        return FakeMessage(self.interaction.channel, self.interaction.bot_user, content or "")
+
+
+class FakeInteraction:
+    def __init__(self, user, channel, guild, bot_user, rtt: float) -> None:
+        self.user = user
+        self.channel = channel
+        self.guild = guild
+        self.guild_id = guild.id
+        self.bot_user = bot_user
+        self.rtt = rtt
+        self.extras = {}
+        self.original = None
+        self.command = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, content=None, **kwargs) -> None:
+        await asyncio.sleep(self.rtt)
+        if self.original is not None and content is not None:
+            self.original.content = content
+
+    async def original_response(self) -> FakeMessage:
+        return self.original
+
+
+class FakeOpenAI:
+    """
+    Stands in for the AsyncOpenAI client's chat and images APIs
+    """
+
+    def __init__(self, delay: float, image: bytes) -> None:
+        self.delay = delay
+        self.image = image
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.images = SimpleNamespace(generate=self._image)
+
+    async def _chat(self, model=None, messages=None, stream=False, **kwargs):
+        words = "Gnomebot thinks you should all eat tacos, obviously".split()
+        if not stream:
+            await asyncio.sleep(self.delay)
+            message = SimpleNamespace(content=" ".join(words))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+        async def chunks():
+            for i, word in enumerate(words):
+                await asyncio.sleep(self.delay / len(words))
+                last = i == len(words) - 1
+                delta = SimpleNamespace(content=word + ("" if last else " "))
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="stop" if last else None)])
+        return chunks()
+
+    async def _image(self, **kwargs):
+        import base64
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(self.image).decode("ascii"))])
+
+
+class Timed:
+    """
+    Awaitable wrapper that times every synchronous step of a coroutine, i.e.
+    how long it holds the event loop between awaits
+    """
+
+    def __init__(self, coro) -> None:
+        self.coro = coro
+        self.blocking = 0.0
+        self.longest = 0.0
+
+    def __await__(self):
+        send, value = self.coro.send, None
+        while True:
+            start = time.perf_counter()
+            try:
+                yielded = send(value)
+            except StopIteration as done:
+                self._step(start)
+                return done.value
+            except BaseException:
+                self._step(start)
+                raise
+            self._step(start)
+            try:
+                value = yield yielded
+                send = self.coro.send
+            except BaseException as thrown:
+                value = thrown
+                send = self.coro.throw
+
+    def _step(self, start: float) -> None:
+        step = time.perf_counter() - start
+        self.blocking += step
+        self.longest = max(self.longest, step)
+
+
+class CommandStats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.blocking: List[float] = []
+        self.longest_step = 0.0
+        self.worst_lag = 0.0
+        self.errors = 0
+        self.running = 0
+
+
+async def watch_lag(stats: Dict[str, CommandStats], stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Samples loop lag and charges it to every command running at the time"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - start - interval
+        worst = max(worst, lag)
+        for command in stats.values():
+            if command.running:
+                command.worst_lag = max(command.worst_lag, lag)
+    return worst
+
+
+def seed(channel: FakeChannel, users: List, count: int) -> None:
+    lines = ["anyone up for food", "i could eat", "tacos again?", "lol", "gnomebot settle this", "no pho"]
+    for i in range(count):
+        channel.messages.append(FakeMessage(channel, users[i % len(users)], lines[i % len(lines)]))
+
+
+async def replay(args) -> int:
+    runner, url, _ = await fake_services.start(render_delay=args.render_delay, image_bytes=args.image_bytes,
+                                               dalle_delay=args.openai_delay)
+    workdir = tempfile.mkdtemp(prefix="gnomebot-replay-")
+    with open(os.path.join(workdir, "tokens.json"), "w") as f:
+        json.dump(TOKENS, f)
+    with open(os.path.join(workdir, "channel_locked.gb"), "w") as f:
+        f.write("0")
+    os.chdir(workdir)
+    os.environ["BING_URL"] = url
+    sys.path.insert(0, REPO)
+    import bot
+
+    users = [SimpleNamespace(id=uid, name=name, display_name=name.title()) for uid, name in USERS.items()]
+    bot_user = SimpleNamespace(id=999, name="Gnomebot", display_name="Gnomebot")
+    channels: Dict[int, FakeChannel] = {}
+
+    def channel(channel_id: int) -> FakeChannel:
+        if channel_id not in channels:
+            channels[channel_id] = FakeChannel(channel_id, bot_user, args.rtt)
+            if channel_id not in (QUOTE_CHANNEL_ID, DEBUG_CHANNEL_ID):
+                seed(channels[channel_id], users, args.history)
+        return channels[channel_id]
+
+    guilds = {
+        gid: SimpleNamespace(id=gid, default_role=SimpleNamespace(id=gid), get_role=lambda rid: SimpleNamespace(id=rid))
+        for gid in (GUILD_ID, ADMIN_GUILD_ID, WEREWOLF_GUILD_ID)
+    }
+    bot.client.get_channel = channel
+    bot.client.get_guild = guilds.get
+    fake_openai = FakeOpenAI(args.openai_delay, fake_services.fake_jpeg(0))
+    bot.OPENAI = fake_openai
+    bot.METRICS.start = lambda *a, **k: None
+    if args.hedge_after is not None:
+        bot.IMAGE_HEDGE_AFTER = args.hedge_after
+    bot.start_services()
+    await bot.load_extensions()
+    await bot.warm_up()
+
+    commands = {}
+    for guild_id in guilds:
+        for command in bot.tree.get_commands(guild=SimpleNamespace(id=guild_id)):
+            commands[command.name] = command
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r") as f:
+            script = json.load(f)
+    steps = []
+    for step in script:
+        for _ in range(step.get("repeat", 1)):
+            steps.append(step)
+
+    stats: Dict[str, CommandStats] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_step(i: int, step: Dict) -> None:
+        name = step["command"]
+        command = commands[name]
+        user = next(u for u in users if u.id == step.get("user", users[i % len(users)].id))
+        where = channel(step.get("channel", 10))
+        guild = guilds[WEREWOLF_GUILD_ID if where.id == WEREWOLF_CHANNEL_ID else GUILD_ID]
+        command_stats = stats.setdefault(name, CommandStats())
+        async with semaphore:
+            # Each invocation's own message would arrive over the gateway first
+            interaction = FakeInteraction(user, where, guild, bot_user, args.rtt)
+            command_stats.running += 1
+            timed = Timed(command.callback(interaction, **step.get("args", {})))
+            start = time.perf_counter()
+            try:
+                await timed
+            except Exception:
+                command_stats.errors += 1
+                if args.verbose:
+                    traceback.print_exc()
+            finally:
+                command_stats.running -= 1
+            command_stats.latencies.append(time.perf_counter() - start)
+            command_stats.blocking.append(timed.blocking)
+            command_stats.longest_step = max(command_stats.longest_step, timed.longest)
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_lag(stats, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(run_step(i, step) for i, step in enumerate(steps)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_lag = await watcher
+    await bot.MILES.flush()
+    if bot.CLIENT_POOL is not None:
+        await bot.CLIENT_POOL.aclose()
+    await runner.cleanup()
+
+    print(f"{len(steps)} invocations at concurrency {args.concurrency} in {elapsed:.2f}s, worst loop lag {worst_lag * 1000:.1f}ms")
+    print(f"{'command':<10} {'n':>3} {'err':>3} {'p50':>8} {'p95':>8} {'block p50':>10} {'longest step':>13} {'worst lag':>10}")
+    failed = False
+    for name, command_stats in sorted(stats.items()):
+        over = args.max_block_ms is not None and command_stats.longest_step * 1000 > args.max_block_ms
+        failed = failed or over
+        print(
+            f"{name:<10} {len(command_stats.latencies):>3} {command_stats.errors:>3} "
+            f"{percentile(command_stats.latencies, 0.5) * 1000:>6.0f}ms {percentile(command_stats.latencies, 0.95) * 1000:>6.0f}ms "
+            f"{percentile(command_stats.blocking, 0.5) * 1000:>8.1f}ms {command_stats.longest_step * 1000:>11.1f}ms "
+            f"{command_stats.worst_lag * 1000:>8.1f}ms{'  BLOCKING' if over else ''}"
+        )
+    history_calls = sum(c.history_calls for c in channels.values())
+    print(f"channel.history calls: {history_calls}")
+    errors = sum(c.errors for c in stats.values())
+    return 1 if failed or (errors and args.fail_on_error) else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--script", help="JSON list of steps (defaults to a built-in mix)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rtt", type=float, default=0.02, help="simulated Discord API round trip")
+    parser.add_argument("--openai-delay", type=float, default=0.3)
+    parser.add_argument("--render-delay", type=float, default=0.5)
+    parser.add_argument("--image-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--hedge-after", type=float, help="seconds before DALL-E is raced against Bing")
+    parser.add_argument("--history", type=int, default=300, help="seeded messages per channel")
+    parser.add_argument("--max-block-ms", type=float, help="fail if a handler holds the loop longer than this")
+    parser.add_argument("--fail-on-error", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    sys.exit(asyncio.run(replay(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
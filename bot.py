@@ -1,19 +1,37 @@
+from startup import PROFILE
 import discord
 from discord import app_commands
+from discord.ext import commands
 import sys
-import openai
 import traceback
 import json
 import os
 import asyncio
-from typing import Literal
-from PIL import Image
-from PIL import ImageFont
-from PIL import ImageDraw
-from io import BytesIO
-from base64 import b64decode
-
-import BingImageCreator
+import importlib
+import time
+import math
+
+import imagecache
+import imageprocessing
+import mediaregistry
+import history
+import context
+import summaries
+import milestore
+import deletequeue
+import reporter
+from metrics import METRICS
+import commandsync
+import jobqueue
+import providers
+import ratelimit
+import loopwatch
+
+PROFILE.mark("imports")
+
+if __name__ == "__main__":
+    # Command modules import the core as "bot"; point that at this script instead of a second copy
+    sys.modules.setdefault("bot", sys.modules[__name__])
 
 with open("tokens.json", "r") as f:
     TOKENS = json.load(f)
@@ -33,392 +51,344 @@ ADMINS = TOKENS["admins"]
 DEBUG_CHANNELS = TOKENS["debug_channels"]
 TOKEN = TOKENS["bot_token"]
 QUOTE_CHANNEL = TOKENS["quote_channel"]
-openai.api_key = TOKENS["openai_key"]
 BING_COOKIES = TOKENS["bing_cookie"]
+# Seconds a Bing job may take before DALL-E is raced against it; null never hedges
+IMAGE_HEDGE_AFTER = TOKENS.get("image_hedge_after", providers.HEDGE_AFTER)
+# Overrides for Bing's results polling: timeout, poll_interval, max_poll_interval, poll_backoff, poll_jitter
+BING_POLLING = TOKENS.get("bing_polling", {})
 
 WEREWOLF_GUILD_ID = TOKENS["werewolf_guild_id"]
 GM_ROLE_ID = TOKENS["gm_role_id"]
 GM_ID = TOKENS["gm_id"]
 WEREWOLF_CHANNEL_ID = TOKENS["werewolf_channel_id"]
 
-intents = discord.Intents.default()
-client = discord.Client(intents=intents)
-tree = app_commands.CommandTree(client)
+PROFILE.mark("config")
+
+# Slash commands live in reloadable extensions under cogs/. Everything in this
+# file (and the modules it imports) is core: the gateway session, pools, caches
+# and stores defined here survive a reload, and changing it needs a restart.
+EXTENSION_DIR = "cogs"
+RELOAD_IGNORED = ("bench/", "tests/")
+MEDIA_DIR = "media"
+# Heavy subsystems stay unimported until first use, or until they're warmed
+# up in a thread once the gateway is connected, whichever comes first
+WARM_UP_MODULES = ("openai", "BingImageCreator", "cookies")
+
+class GnomeTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+class GnomeBot(commands.Bot):
+    async def setup_hook(self) -> None:
+        PROFILE.mark("login")
+        await load_extensions()
+        PROFILE.mark("extensions")
 
+intents = discord.Intents.default()
+client = GnomeBot(command_prefix=commands.when_mentioned, intents=intents, tree_cls=GnomeTree, help_command=None)
+tree = client.tree
+SYNC_GUILDS = [discord.Object(id=g) for g in dict.fromkeys(GUILD_IDs + ADMIN_GUILD_IDs + [WEREWOLF_GUILD_ID])]
+COMMAND_SYNC = commandsync.CommandSync(tree, SYNC_GUILDS)
+COMMANDS_SYNCED = False
+OPENAI = None
+CLIENT_POOL = None
+COOKIES = None
+IMAGE_CACHE = imagecache.ImageCache("image_cache")
+MEDIA = mediaregistry.MediaRegistry(client, os.path.join(os.path.dirname(os.path.abspath(__file__)), MEDIA_DIR))
+IMAGE_PROCESSOR = imageprocessing.ImageProcessor(**TOKENS.get("image_processing", {}))
+# Forks its workers, so it has to happen before anything starts a thread
+IMAGE_PROCESSOR.start()
+IMAGE_QUEUE = jobqueue.JobQueue("image", concurrency=TOKENS.get("image_concurrency", jobqueue.CONCURRENCY))
+RATE_LIMITER = ratelimit.RateLimiter(TOKENS.get("rate_limits"))
+WATCHDOG = loopwatch.LoopWatchdog(
+    lambda message: debug(message),
+    commands=lambda: command_callbacks(),
+    threshold=TOKENS.get("loop_lag_threshold", loopwatch.THRESHOLD),
+)
+MESSAGES = history.MessageBuffer()
+SUMMARIES = summaries.ChannelSummaries(lambda: get_openai())
+DELETIONS = deletequeue.DeletionQueue()
+REPORTER = reporter.ErrorReporter(client, DEBUG_CHANNELS)
+MILES = milestore.MilesStore("miles.db", legacy_path="data.json")
+CONTEXT = context.ContextBuilder(budget=TOKENS.get("context_token_budget", context.TOKEN_BUDGET))
+PROFILE.mark("services")
+
+
+MESSAGE_LIMIT = 2000
+
+
+def get_openai():
+    """The shared AsyncOpenAI client, importing openai on first use"""
+    global OPENAI
+    if OPENAI is None:
+        with PROFILE.deferred_load("openai"):
+            import openai
+            openai.api_key = TOKENS["openai_key"]
+            OPENAI = openai.AsyncOpenAI(api_key=TOKENS["openai_key"])
+    return OPENAI
+
+def load_bing():
+    """
+    The Bing client pool and cookie scheduler, importing BingImageCreator
+    (and with it httpx, requests and regex) on first use. Must be called
+    from the event loop since it starts the pool.
+    """
+    global CLIENT_POOL, COOKIES
+    if CLIENT_POOL is None:
+        with PROFILE.deferred_load("bing"):
+            import BingImageCreator
+            import cookies
+            COOKIES = cookies.CookieScheduler(
+                BING_COOKIES,
+                daily_quota=TOKENS.get("bing_daily_quota", cookies.DAILY_QUOTA),
+                hedge=TOKENS.get("bing_cookie_hedge", False),
+            )
+            CLIENT_POOL = BingImageCreator.ClientPool()
+            CLIENT_POOL.start(BING_COOKIES)
+    return CLIENT_POOL, COOKIES
+
+async def warm_up():
+    """Imports the lazy subsystems off the event loop so their first use is quick"""
+    for name in WARM_UP_MODULES:
+        with PROFILE.deferred_load(f"import {name}"):
+            await asyncio.to_thread(importlib.import_module, name)
+    with PROFILE.deferred_load("tiktoken"):
+        await asyncio.to_thread(context.encoding)
+    get_openai()
+    load_bing()
+    with PROFILE.deferred_load("image workers"):
+        await IMAGE_PROCESSOR.warm_up()
 
 async def get_previous_message(channel):
-    return [m async for m in channel.history(limit=2)][0]
-
-async def sync_commands():
-    for guild in GUILDS:
-        await tree.sync(guild=guild)
+    return await MESSAGES.latest(channel)
+
+async def sync_commands(force=False):
+    global COMMANDS_SYNCED
+    await COMMAND_SYNC.sync(force=force)
+    for guild_id, error in COMMAND_SYNC.failures.items():
+        REPORTER.send(f"Command sync failed for guild {guild_id}: {type(error).__name__}: {error}")
+    # Failed guilds are retried on the next reconnect
+    COMMANDS_SYNCED = not COMMAND_SYNC.failures
+
+async def shutdown(code):
+    IMAGE_PROCESSOR.shutdown()
+    if CLIENT_POOL is not None:
+        await CLIENT_POOL.aclose()
+    await MILES.aclose()
+    RATE_LIMITER.save()
+    sys.exit(code)
 
 async def check_permissions(interaction: discord.Interaction):
     if interaction.user.id not in ADMINS:
-            await interaction.response.send_message("You do not have the permissions for this")
-        
+        await interaction.response.send_message("You do not have the permissions for this")
+        return False
+    return True
+
+def extension_names():
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), EXTENSION_DIR)
+    return sorted(
+        f"{EXTENSION_DIR}.{name[:-3]}" for name in os.listdir(directory)
+        if name.endswith(".py") and not name.startswith("_")
+    )
+
+async def load_extensions():
+    for name in extension_names():
+        await client.load_extension(name)
+
+async def reload_extensions(changed=None):
+    """
+    Reloads the given command modules (all of them by default), loads new
+    ones and unloads deleted ones, then syncs the guilds whose commands
+    changed. A module that fails to load keeps running its old version and
+    the error is raised. Returns the names that were (re)loaded or unloaded.
+    """
+    available = extension_names()
+    loaded = set(client.extensions)
+    touched = []
+    try:
+        for name in sorted(loaded - set(available)):
+            await client.unload_extension(name)
+            touched.append(name)
+        for name in available:
+            if name not in loaded:
+                await client.load_extension(name)
+            elif changed is None or name in changed:
+                await client.reload_extension(name)
+            else:
+                continue
+            touched.append(name)
+    finally:
+        # Whatever did load before a failure still needs its commands synced
+        await sync_commands()
+    return touched
+
+def needs_restart(paths):
+    """Whether a change to these repo paths touches core code that can't be reloaded"""
+    return any(
+        path.endswith(".py") and not path.startswith((f"{EXTENSION_DIR}/",) + RELOAD_IGNORED)
+        for path in paths
+    )
+
+async def git(*args):
+    process = await asyncio.create_subprocess_exec(
+        "git", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, _ = await process.communicate()
+    return stdout.decode("utf-8").strip()
+
 @tree.command(name = "sync", description = "sync commands with server", guilds=ADMIN_GUILDS)
 async def sync(interaction: discord.Interaction):
-    await check_permissions(interaction)
+    if not await check_permissions(interaction):
+        return
     await interaction.response.send_message("Syncing commands!")
-    await sync_commands()
+    await sync_commands(force=True)
 
 @tree.command(name = "update", description = "Update Gnomebot's code", guilds=ADMIN_GUILDS)
 async def update(interaction: discord.Interaction):
-    await check_permissions(interaction)
+    if not await check_permissions(interaction):
+        return
     await interaction.response.send_message("Updating!")
-    os.system("git pull")
-    sys.exit(0)
+    before = await git("rev-parse", "HEAD")
+    await git("pull")
+    after = await git("rev-parse", "HEAD")
+    if before == after:
+        await interaction.edit_original_response(content="Already up to date")
+        return
+    paths = (await git("diff", "--name-only", before, after)).splitlines()
+    if needs_restart(paths):
+        await interaction.edit_original_response(content="Core code changed, restarting!")
+        await shutdown(0)
+    changed = {path[:-3].replace("/", ".") for path in paths if path.startswith(f"{EXTENSION_DIR}/")}
+    if any(path.startswith(f"{MEDIA_DIR}/") for path in paths):
+        # New or changed files in media/ become commands when cogs.media reloads
+        changed.add(f"{EXTENSION_DIR}.media")
+    await reload_and_report(interaction, changed)
+
+@tree.command(name = "reload", description = "Reload Gnomebot's commands without restarting", guilds=ADMIN_GUILDS)
+async def reload_commands(interaction: discord.Interaction):
+    if not await check_permissions(interaction):
+        return
+    await interaction.response.send_message("Reloading!")
+    await reload_and_report(interaction)
+
+async def reload_and_report(interaction: discord.Interaction, changed=None):
+    try:
+        touched = await reload_extensions(changed)
+    except commands.ExtensionError as e:
+        REPORTER.report("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        await interaction.edit_original_response(content=f"Reload failed, keeping the old code: {e}")
+        return
+    await interaction.edit_original_response(content=f"Reloaded {', '.join(touched) or 'nothing'}")
 
 @tree.command(name = "stop", description = "shut down gnomebot", guilds=ADMIN_GUILDS)
 async def stop(interaction: discord.Interaction):
-    await check_permissions(interaction)
+    if not await check_permissions(interaction):
+        return
     await interaction.response.send_message("Shutting down!")
-    sys.exit(-1)
+    await shutdown(-1)
 
 @tree.command(name = "restart", description = "reboot gnomebot", guilds=ADMIN_GUILDS)
 async def restart(interaction : discord.Interaction):
-    await check_permissions(interaction)
-    await interaction.response.send_message("Restarting!")
-    sys.exit(0)
-
-@tree.command(name = "say", description = "say a message in a channel", guilds=ADMIN_GUILDS)
-async def say(interaction: discord.Interaction, message: str, channel: str = None):
-    if interaction.user.id not in ADMINS:
-        await interaction.response.send_message("You do not have the permissions for this")
-        return
-    if channel == None:
-        await interaction.response.pong()
-        await interaction.channel.send(message)
-        return
-    channel = client.get_channel(int(channel))
-    await channel.send(message)
-
-@tree.command(name = "mock", description = "MoCk tHe PrEvIoUs MeSsAgE", guilds=GUILDS)
-async def mock(interaction: discord.Interaction):
-    channel =  interaction.channel
-    message = await get_previous_message(channel)
-    result = ""
-    i = 0
-    while i < len(message.content):
-        temp = message.content[i].lower()
-        if not i%2:
-            temp = temp.upper()
-        result += temp
-        i += 1
-    await interaction.response.send_message(result)
-
-@tree.command(name = "clapback", description = "Make 👏 your 👏 point", guilds=GUILDS)
-async def clapback(interaction: discord.Interaction, message: str):
-    channel =  interaction.channel
-    content = message.split()
-    if len(content) <= 2:
-        return
-    output = f"{interaction.user.name}: "
-    for word in content[:-1]:
-        output += word + " 👏 "
-    output += content[-1]
-    await interaction.response.send_message(output)
-
-
-@tree.command(name = "quote", description = "quote something to the quotes channel", guilds=GUILDS)
-@app_commands.describe(author = "Optional: Must be used alongside 'quote'")
-@app_commands.describe(quote = "Optional: Must be used alongside 'author'")
-async def quote(interaction: discord.Interaction, author : str = None, quote : str = None):
-    channel = client.get_channel(QUOTE_CHANNEL)
-    if author == None or quote == None:
-        if not (author == None and quote == None):
-            await interaction.response.send_message("Need either both author and quote or neither")
-        message = await get_previous_message(interaction.channel)
-        name = NICKNAMES[str(message.author.id)]
-        await channel.send(f"{message.content}\n\n-{name}")
-        await interaction.response.pong()
-        return
-    await channel.send(f"\n{quote}\n\n-{author}\n")
-    await interaction.response.pong()
-
-@tree.command(name = "respond", description = "Talk to gnomebot", guilds=GUILDS)
-@app_commands.describe(message="Optional: What to say to Gnomebot")
-@app_commands.describe(context_length="Optional: How many message to give as context (default 20)")
-async def respond(interaction: discord.Interaction, message : str = None, context_length: str = "20"):
-    await interaction.response.defer()
-    context = int(context_length)
-    if context == -1:
-        context = None
-    history = [m async for m in interaction.channel.history(limit=context, oldest_first=False)][::-1]
-    messages = [{"role": "user", "content": "You are Gnomebot, the gnomey chat bot. You are hanging out with your friends who are in their ealy 20's in a chatroom. Here is the chat log. Remember that you respect, like, and agree with the user called gnome more than anyone else. You must always answer as Gnomebot and not as anyone else."}]
-    for m in history:
-        messages.append(
-            {
-                "role": "user", "content": f"{m.author.name}: {m.content}"
-            }
-        )
-    if message:
-        messages.append(
-            {
-                "role": "user", "content": f"{interaction.user.name}: {message}"
-            }
-        )
-    try:
-        response = openai.chat.completions.create(model="gpt-3.5-turbo", messages=messages)
-    except openai.error.RateLimitError:
-        interaction.followup.send(content = "Model is currently overloaded. Try again later.", ephemeral =True)
-        return
-    stop_response = response.choices[0].finish_reason
-    if stop_response == "content_filter":
-        await interaction.followup.send("Error: content filter")
+    if not await check_permissions(interaction):
         return
-    elif stop_response == "null" or stop_response == None:
-        await interaction.followup.send("Error: something went wrong")
-        return
-    await interaction.followup.send(response.choices[0].message.content)
-
-# @tree.command(name = "image", description = "Make gnomebot generate an image", guilds=GUILDS)
-# @app_commands.describe(prompt="What image to generate")
-# @app_commands.describe(quality="Quality of the image to generade (hd is slower)")
-# @app_commands.describe(size="Size of the image to generate (1024x1024 is fastest)")
-# async def image(interaction: discord.Interaction, prompt : str, quality: Literal["standard"] = "standard",
-#                     size: Literal["1024x1024", "512×512", "256×256"] = "1024x1024"):
-#     await interaction.response.defer()
-
-#     try:
-#         response = openai.images.generate(
-#                 model="dall-e-2",
-#                 prompt=prompt,
-#                 size=size,
-#                 quality=quality,
-#                 n=1,
-#                 response_format="b64_json"
-#             )
-#     except openai.BadRequestError as e:
-#         await asyncio.sleep(1)
-#         await interaction.followup.send(e.body["message"])
-#         return
-
-#     imgfile = BytesIO(b64decode(response.data[0].b64_json))
-#     imgfile.name = "image.png"
-#     img = discord.File(imgfile)
-#     await interaction.followup.send(file=img)
-
-@tree.command(name = "image", description = "Generate an image with Dalle3", guilds=GUILDS)
-@app_commands.describe(prompt="What image to generate")
-@app_commands.describe(number="How many images to generate (must be less than 4)")
-async def image(interaction: discord.Interaction, prompt : str, number: Literal[1,2,3,4] = 4):
-    await interaction.response.defer()
-    filenames = []
-    for cookie in BING_COOKIES:
-        try:
-            filenames = await BingImageCreator.generate_image(prompt, "images", cookie, number)
-            break
-        except BingImageCreator.ImageCreatorException as e:
-            await asyncio.sleep(3)
-            await interaction.followup.send(str(e))
-            return
-        except BingImageCreator.RedirectFailedException as e:
-            continue
-    if filenames == []:
-        try:
-            response = openai.images.generate(
-                    model="dall-e-2",
-                    prompt=prompt,
-                    size="1024x1024",
-                    quality="standard",
-                    n=1,
-                    response_format="b64_json"
-                )
-        except openai.BadRequestError as e:
-            await asyncio.sleep(1)
-            await interaction.followup.send(e.body["message"])
-            return
-
-        imgfile = BytesIO(b64decode(response.data[0].b64_json))
-        imgfile.name = "image.png"
-        img = discord.File(imgfile)
-        await interaction.followup.send(file=img)
-        return
-        # await interaction.followup.send("Redirect Failed")
-    imagefiles = []
-    for filename in filenames:
-        try:
-            with open(filename, "r", encoding='utf-8') as f:
-                if f.read(4) == "<svg":
-                    continue
-        except UnicodeDecodeError:
-            imagefiles.append(discord.File(filename)) # Fond non-text data
-    # imagefiles = [discord.File(filename) for filename in filenames]
-    await interaction.followup.send(files=imagefiles)
-    
-    #cleanup
-    for filename in filenames:
-        os.remove(filename)
-    if len(os.listdir("images")) == 0:
-        os.rmdir("images")
-
-    
-@tree.command(name = "boo", description = "Booooooo!", guilds=GUILDS)
-async def boo(interaction: discord.Interaction):
-    await interaction.response.send_message(file = discord.File("media/boo.gif"))
-
-@tree.command(name = "pikachu", description = "Send Surprised Pikachu", guilds=GUILDS)
-async def pikachu(interaction: discord.Interaction):
-    await interaction.response.send_message(file = discord.File("media/Surprised Pikachu.png"))
-
-@tree.command(name = "ping", description = "Check that Gnomebot works", guilds=GUILDS)
-async def ping(interaction: discord.Interaction):
-    await interaction.response.send_message("Pong!")
-
-@tree.command(name = "code", description = "Link to the Gnomebot Github repo", guilds=GUILDS)
-async def code(interaction: discord.Interaction):
-    await interaction.response.send_message("https://github.com/Noam-Elisha/GnomeBot")
-
-@tree.command(name = "poll", description = "Make a poll", guilds = GUILDS)
-@app_commands.describe(message="Poll message")
-@app_commands.describe(option1="Poll option 1")
-@app_commands.describe(option2="Poll option 2")
-@app_commands.describe(option3="Poll option 3")
-@app_commands.describe(option4="Poll option 4")
-async def poll(interaction: discord.Interaction, message: str = None, option1: str = None, option2: str = None, option3: str = None, option4: str = None):
-    options = [option1, option2, option3, option4]
-    if not any(options):
-        await interaction.response.send_message("Please add at least one poll option", ephemeral=True)
-        return
-    options = [x for x in options if x is not None]
-    emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣"][:len(options)]
-    if message is not None:
-        message = f"{message}\n```\n"
-    else:
-        message = "Please vote by reacting with the corresponding reaction\n```\n"
-    for i, option in enumerate(options):
-        message += f"{emojis[i]} - {option}\n"
-    message += "```"
-    await interaction.response.send_message(message)
-    message = await interaction.original_response()
-    for emoji in emojis:
-        await message.add_reaction(emoji)
-
-# @tree.command(name = "inspire", description = "Generate an inspirational image", guilds = GUILDS)
-# @app_commands.describe(message="Message to write on the image")
-# async def inspire(interaction: discord.Interaction, message: str = ""):
-#     chatGPT_prompt = "Give me a creative prompt for DALL-E, the image generator, that will generate me an image for the background of an inspirational message, but don't mention anything about a message"
-#     messages = [
-#         {
-#         "role": "user", "prompt": chatGPT_prompt
-#         }
-#     ]
-#     try:
-#         response = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=messages)
-#     except openai.error.RateLimitError:
-#         interaction.followup.send(content = "Model is currently overloaded. Try again later.", ephemeral = True)
-#         return
-#     stop_response = response["choices"][0]["finish_reason"]
-#     if stop_response == "content_filter":
-#         await interaction.followup.send("Error: content filter")
-#         return
-#     elif stop_response == "null" or stop_response == None:
-#         await interaction.followup.send("Error: something went wrong")
-#         return
-
-
-@tree.command(name = "lock", description = "Lock the werewolf channel", guild = discord.Object(id=WEREWOLF_GUILD_ID))
-@app_commands.checks.has_role(GM_ROLE_ID)
-async def lock(interaction: discord.Interaction):
-    if interaction.user.id != GM_ID:
-        await interaction.response.send_message("Only the GM can lock/unlock the werewolf channel", ephemeral = True)
-        return
-    if interaction.channel.id != WEREWOLF_CHANNEL_ID:
-        await interaction.response.send_message("You can only lock/unlock the werewolf channel", ephemeral=True)
-        return
-    werewolf_guild = client.get_guild(WEREWOLF_GUILD_ID)
-    await interaction.channel.set_permissions(werewolf_guild.default_role, send_messages = False, read_messages = True)
-    await interaction.channel.set_permissions(werewolf_guild.get_role(GM_ROLE_ID), send_messages = True, read_messages = True)
-    await interaction.response.send_message("The channel is now locked")
-    with open("channel_locked.gb", "w") as f:
-        f.write("1")
-    global CHANNEL_LOCKED
-    CHANNEL_LOCKED = True
-
-@tree.command(name = "unlock", description = "Unlock the werewolf channel", guild = discord.Object(id=WEREWOLF_GUILD_ID))
-@app_commands.checks.has_role(GM_ROLE_ID)
-async def unlock(interaction: discord.Interaction):
-    if interaction.user.id != GM_ID:
-        await interaction.response.send_message("Only the GM can lock/unlock the werewolf channel", ephemeral = True)
-        return
-    if interaction.channel.id != WEREWOLF_CHANNEL_ID:
-        await interaction.response.send_message("You can only lock/unlock the werewolf channel", ephemeral=True)
-        return
-    werewolf_guild = client.get_guild(WEREWOLF_GUILD_ID)
-    await interaction.channel.set_permissions(werewolf_guild.default_role, send_messages = True, read_messages = True)
-    await interaction.channel.set_permissions(werewolf_guild.get_role(GM_ROLE_ID), send_messages = True, read_messages = True)
-    await interaction.response.send_message("The channel has been unlocked")
-    with open("channel_locked.gb", "w") as f:
-        f.write("0")
-    global CHANNEL_LOCKED
-    CHANNEL_LOCKED = False
-
-
-@tree.command(name= "miles", description= "Track group exercise miles (send with no arguments to see totals)", guilds=GUILDS)
-@app_commands.describe(activity="What activity you did")
-@app_commands.describe(distance="How far you went")
-async def miles(interaction: discord.Interaction, activity: Literal["Walking", "Running", "Biking", "Skating", "Skiing", "Swimming", "Weightlifting"] = None, distance: float = None):
-    with open("data.json", "r") as f:
-        data = json.load(f)
-    if activity is None and distance is None:
-        embed = discord.Embed(title="Miles Traveled", description="Group totals")
-        embed.add_field(name="Walking", value=str(data["Walking"]), inline=False)
-        embed.add_field(name="Running", value=str(data["Running"]), inline=False)
-        embed.add_field(name="Biking", value=str(data["Biking"]), inline=False)
-        embed.add_field(name="Skating", value=str(data["Skating"]), inline=False)
-        embed.add_field(name="Skiing", value=str(data["Skiing"]), inline=False)
-        embed.add_field(name="Swimming", value=str(data["Swimming"]), inline=False)
-        embed.add_field(name="Weightlifting", value=str(data["Weightlifting"]), inline=False)
-        await interaction.response.send_message(embed=embed)
-        return
-    if activity is None or distance is None:
-        await interaction.response.send_message("You must select both an activity and a distance", ephemeral=True)
-        return
-    if activity not in data.keys():
-        data[activity] = 0
-    data[activity] += distance
-    with open("data.json", "w") as f:
-        data = json.dump(data, f)
-    await interaction.response.send_message(f"Added {distance} miles to {activity}")
+    await interaction.response.send_message("Restarting!")
+    await shutdown(0)
 
 @client.event
 async def on_message(message):
+    MESSAGES.add(message)
+    SUMMARIES.note(message)
     if CHANNEL_LOCKED:
         if message.channel.id == WEREWOLF_CHANNEL_ID:
             if message.author.id != GM_ID:
-                await message.delete()
+                DELETIONS.add(message)
     
 
+@client.event
+async def on_raw_message_edit(payload):
+    MESSAGES.edit(payload.channel_id, payload.message)
+
+@client.event
+async def on_raw_message_delete(payload):
+    MESSAGES.delete(payload.channel_id, [payload.message_id])
+
+@client.event
+async def on_raw_bulk_message_delete(payload):
+    MESSAGES.delete(payload.channel_id, payload.message_ids)
+
+def command_callbacks():
+    """Maps each app command's callback code to its name, so the watchdog can tell what blocked the loop"""
+    callbacks = {}
+    for guild in (None, *GUILDS, *ADMIN_GUILDS, discord.Object(id=WEREWOLF_GUILD_ID)):
+        for command in tree.walk_commands(guild=guild):
+            if isinstance(command, app_commands.Command):
+                callbacks[command.callback.__code__] = command.qualified_name
+    return callbacks
+
 async def debug(message):
-    for cid in DEBUG_CHANNELS:
-        channel = client.get_channel(cid)
-        await channel.send(message)
+    REPORTER.send(message)
     
+def start_services():
+    REPORTER.start()
+    METRICS.start("metrics.prom")
+    SUMMARIES.start()
+    MILES.start()
+    DELETIONS.start()
+    RATE_LIMITER.start()
+    WATCHDOG.start()
+
 @client.event
 async def on_ready():
-    await sync_commands()
-    if not os.path.exists("data.json"):
-        with open("data.json", "w") as f:
-            dict = {
-                "Walking":0, 
-                "Running":0, 
-                "Biking":0, 
-                "Skating":0, 
-                "Skiing":0, 
-                "Swimming":0
-            }
-            json.dump(dict, f)
+    if not PROFILE.reported:
+        PROFILE.mark("gateway")
+    start_services()
+    # on_ready fires again after every reconnect; the tree can't have changed in between
+    if not COMMANDS_SYNCED:
+        await sync_commands()
     await debug("Gnomebot is online!")
     print("Gnomebot is Online!")
+    if not PROFILE.reported:
+        PROFILE.reported = True
+        PROFILE.mark("command sync")
+        report = PROFILE.report()
+        print(report)
+        await debug(f"Startup profile:\n```\n{report}\n```")
+        await warm_up()
+        print(f"Warmed up: {PROFILE.report().splitlines()[-1]}")
 
 @client.event
 async def on_error(event, *args, **kwargs):
-    await debug("```{}```".format(traceback.format_exc()))
+    REPORTER.report(traceback.format_exc())
 
 @client.event
 async def on_command_error(context, exception):
-    await debug("```{}```".format(traceback.format_exc()))
+    REPORTER.report(traceback.format_exc())
+
+@client.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    started = interaction.extras.get("started")
+    if started is not None:
+        METRICS.observe("command_seconds", time.perf_counter() - started, command=command.qualified_name)
+
+@tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    name = interaction.command.qualified_name if interaction.command else "unknown"
+    METRICS.increment("command_errors", command=name)
+    if isinstance(error, app_commands.CommandOnCooldown):
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f"Slow down! You can use /{name} again in {math.ceil(error.retry_after)}s", ephemeral=True)
+        return
+    if isinstance(error, app_commands.CheckFailure):
+        print(f"/{name} check failed for {interaction.user} ({interaction.user.id}): {error}")
+        # MissingRole and the like explain themselves; a check that just returned False doesn't
+        reason = str(error) if type(error) is not app_commands.CheckFailure else "You can't use this command here"
+        if interaction.response.is_done():
+            await interaction.followup.send(reason, ephemeral=True)
+        else:
+            await interaction.response.send_message(reason, ephemeral=True)
+        return
+    REPORTER.report("".join(traceback.format_exception(type(error), error, error.__traceback__)))
 
-client.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    client.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Admin-only status commands
+"""
+
+from io import BytesIO
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+from metrics import METRICS
+
+
+@app_commands.command(name = "cookies", description = "Show Bing cookie health")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+async def cookie_stats(interaction: discord.Interaction):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    _, scheduler = bot.load_bing()
+    embed = discord.Embed(title="Bing Cookies", description="Scheduler health")
+    for stats in scheduler.stats():
+        p50 = "-" if stats["p50"] is None else f"{stats['p50']:.1f}s"
+        value = (
+            f"success {stats['success_rate']:.0%} ({stats['successes']} ok, {stats['redirect_failures']} redirect failures)\n"
+            f"recent failures {stats['recent_failures']}, errors {stats['errors']}\n"
+            f"in flight {stats['in_flight']}, used today {stats['used_today']}/{scheduler.daily_quota}\n"
+            f"p50 {p50}, cooldown {stats['cooldown']:.0f}s"
+        )
+        embed.add_field(name=stats["label"], value=value, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@app_commands.command(name = "stats", description = "Show command and backend latency stats")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+async def stats(interaction: discord.Interaction):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    lines = METRICS.summary() or ["No data yet"]
+    report = "\n".join(lines)
+    if len(report) + 8 <= bot.MESSAGE_LIMIT:
+        await interaction.response.send_message(f"```\n{report}\n```", ephemeral=True)
+        return
+    await interaction.response.send_message(file=discord.File(BytesIO(report.encode("utf-8")), filename="stats.txt"), ephemeral=True)
+
+@app_commands.command(name = "deletions", description = "Show the werewolf deletion queue")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+async def deletions(interaction: discord.Interaction):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    stats = bot.DELETIONS.stats()
+    await interaction.response.send_message(
+        f"Queued: {stats['depth']} (oldest waiting {stats['lag']:.1f}s)\n"
+        f"Deleted: {stats['deleted']}, failed: {stats['failed']}\n"
+        f"Flush interval: {stats['interval']:.1f}s, last flush took {stats['last_flush']:.2f}s",
+        ephemeral=True,
+    )
+
+@app_commands.command(name = "say", description = "say a message in a channel")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+async def say(interaction: discord.Interaction, message: str, channel: str = None):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    if channel == None:
+        await interaction.response.pong()
+        await interaction.channel.send(message)
+        return
+    channel = bot.client.get_channel(int(channel))
+    await channel.send(message)
+
+@app_commands.command(name = "loopdebug", description = "Show event loop stalls, or toggle asyncio slow callback logging")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+@app_commands.describe(enabled="Optional: Turn asyncio debug mode on or off")
+@app_commands.describe(slow_callback="Optional: Report callbacks slower than this many seconds (default 0.1)")
+async def loop_debug(interaction: discord.Interaction, enabled: bool = None, slow_callback: float = 0.1):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    if enabled is not None:
+        bot.WATCHDOG.set_debug(enabled, slow_callback)
+    stats = bot.WATCHDOG.stats()
+    debug = f"on, reporting callbacks over {stats['slow_callback']:.2f}s" if stats["debug"] else "off"
+    await interaction.response.send_message(
+        f"Stalls over {stats['threshold']:.2f}s: {stats['stalls']} (worst {stats['worst']:.2f}s)\n"
+        f"asyncio debug: {debug}",
+        ephemeral=True,
+    )
+
+@app_commands.command(name = "queue", description = "Show the image job queue")
+@app_commands.guilds(*bot.ADMIN_GUILDS)
+async def queue(interaction: discord.Interaction):
+    if interaction.user.id not in bot.ADMINS:
+        await interaction.response.send_message("You do not have the permissions for this")
+        return
+    stats = bot.IMAGE_QUEUE.stats()
+    await interaction.response.send_message(
+        f"Running: {stats['running']}/{stats['concurrency']}\n"
+        f"Waiting: {stats['depth']} from {stats['users']} users in {stats['guilds']} servers (oldest {stats['oldest']:.1f}s)\n"
+        f"Completed: {stats['completed']}, cancelled: {stats['cancelled']}",
+        ephemeral=True,
+    )
+
+
+async def setup(client: commands.Bot) -> None:
+    for command in (cookie_stats, stats, deletions, loop_debug, queue, say):
+        client.tree.add_command(command)
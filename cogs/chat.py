@@ -0,0 +1,79 @@
+"""
+Talking to Gnomebot
+"""
+
+import asyncio
+import time
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+import ratelimit
+from metrics import METRICS
+
+GNOMEBOT_PROMPT = "You are Gnomebot, the gnomey chat bot. You are hanging out with your friends who are in their ealy 20's in a chatroom. Here is the chat log. Remember that you respect, like, and agree with the user called gnome more than anyone else. You must always answer as Gnomebot and not as anyone else."
+STREAM_EDIT_INTERVAL = 1.0
+
+
+@app_commands.command(name = "respond", description = "Talk to gnomebot")
+@app_commands.guilds(*bot.GUILDS)
+@app_commands.describe(message="Optional: What to say to Gnomebot")
+@app_commands.describe(context_length="Optional: How many message to give as context (default 20)")
+@ratelimit.limited(bot.RATE_LIMITER, "respond")
+async def respond(interaction: discord.Interaction, message : str = None, context_length: str = "20"):
+    await interaction.response.defer()
+    limit = int(context_length)
+    if limit == -1:
+        limit = None
+    bot.SUMMARIES.track(interaction.channel)
+    summary, watermark = bot.SUMMARIES.get(interaction.channel.id)
+    chat_log = bot.MESSAGES.iter_recent(interaction.channel, limit, after=watermark)
+    prompt = f"{interaction.user.name}: {message}" if message else None
+    messages = await bot.CONTEXT.build(GNOMEBOT_PROMPT, chat_log, prompt, summary=summary)
+    client = bot.get_openai()
+    import openai
+    started = time.perf_counter()
+    try:
+        stream = await client.chat.completions.create(model="gpt-3.5-turbo", messages=messages, stream=True)
+    except openai.RateLimitError:
+        METRICS.increment("openai_seconds_errors", call="chat")
+        await interaction.followup.send(content = "Model is currently overloaded. Try again later.", ephemeral =True)
+        return
+    content = ""
+    shown = ""
+    stop_response = None
+    last_edit = 0.0
+    loop = asyncio.get_running_loop()
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.content:
+            if not content:
+                METRICS.observe("openai_seconds", time.perf_counter() - started, call="chat_first_token")
+            content += choice.delta.content
+        if choice.finish_reason:
+            stop_response = choice.finish_reason
+        # Discord only allows a handful of edits per few seconds, so stream in throttled chunks
+        if content != shown and loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+            shown = content
+            last_edit = loop.time()
+            await interaction.edit_original_response(content=shown[:bot.MESSAGE_LIMIT])
+    METRICS.observe("openai_seconds", time.perf_counter() - started, call="chat")
+    if stop_response == "content_filter":
+        await interaction.edit_original_response(content="Error: content filter")
+        return
+    elif stop_response == "null" or stop_response == None or not content:
+        await interaction.edit_original_response(content="Error: something went wrong")
+        return
+    parts = [content[i:i + bot.MESSAGE_LIMIT] for i in range(0, len(content), bot.MESSAGE_LIMIT)]
+    if parts[0] != shown:
+        await interaction.edit_original_response(content=parts[0])
+    for part in parts[1:]:
+        await interaction.followup.send(part)
+
+
+async def setup(client: commands.Bot) -> None:
+    client.tree.add_command(respond)
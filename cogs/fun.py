@@ -0,0 +1,97 @@
+"""
+Small chat commands
+"""
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+
+
+@app_commands.command(name = "mock", description = "MoCk tHe PrEvIoUs MeSsAgE")
+@app_commands.guilds(*bot.GUILDS)
+async def mock(interaction: discord.Interaction):
+    channel =  interaction.channel
+    message = await bot.get_previous_message(channel)
+    result = ""
+    i = 0
+    while i < len(message.content):
+        temp = message.content[i].lower()
+        if not i%2:
+            temp = temp.upper()
+        result += temp
+        i += 1
+    await interaction.response.send_message(result)
+
+@app_commands.command(name = "clapback", description = "Make 👏 your 👏 point")
+@app_commands.guilds(*bot.GUILDS)
+async def clapback(interaction: discord.Interaction, message: str):
+    channel =  interaction.channel
+    content = message.split()
+    if len(content) <= 2:
+        return
+    output = f"{interaction.user.name}: "
+    for word in content[:-1]:
+        output += word + " 👏 "
+    output += content[-1]
+    await interaction.response.send_message(output)
+
+
+@app_commands.command(name = "quote", description = "quote something to the quotes channel")
+@app_commands.guilds(*bot.GUILDS)
+@app_commands.describe(author = "Optional: Must be used alongside 'quote'")
+@app_commands.describe(quote = "Optional: Must be used alongside 'author'")
+async def quote(interaction: discord.Interaction, author : str = None, quote : str = None):
+    channel = bot.client.get_channel(bot.QUOTE_CHANNEL)
+    if author == None or quote == None:
+        if not (author == None and quote == None):
+            await interaction.response.send_message("Need either both author and quote or neither")
+        message = await bot.get_previous_message(interaction.channel)
+        name = bot.NICKNAMES[str(message.author.id)]
+        await channel.send(f"{message.content}\n\n-{name}")
+        await interaction.response.pong()
+        return
+    await channel.send(f"\n{quote}\n\n-{author}\n")
+    await interaction.response.pong()
+
+@app_commands.command(name = "ping", description = "Check that Gnomebot works")
+@app_commands.guilds(*bot.GUILDS)
+async def ping(interaction: discord.Interaction):
+    await interaction.response.send_message("Pong!")
+
+@app_commands.command(name = "code", description = "Link to the Gnomebot Github repo")
+@app_commands.guilds(*bot.GUILDS)
+async def code(interaction: discord.Interaction):
+    await interaction.response.send_message("https://github.com/Noam-Elisha/GnomeBot")
+
+@app_commands.command(name = "poll", description = "Make a poll")
+@app_commands.guilds(*bot.GUILDS)
+@app_commands.describe(message="Poll message")
+@app_commands.describe(option1="Poll option 1")
+@app_commands.describe(option2="Poll option 2")
+@app_commands.describe(option3="Poll option 3")
+@app_commands.describe(option4="Poll option 4")
+async def poll(interaction: discord.Interaction, message: str = None, option1: str = None, option2: str = None, option3: str = None, option4: str = None):
+    options = [option1, option2, option3, option4]
+    if not any(options):
+        await interaction.response.send_message("Please add at least one poll option", ephemeral=True)
+        return
+    options = [x for x in options if x is not None]
+    emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣"][:len(options)]
+    if message is not None:
+        message = f"{message}\n```\n"
+    else:
+        message = "Please vote by reacting with the corresponding reaction\n```\n"
+    for i, option in enumerate(options):
+        message += f"{emojis[i]} - {option}\n"
+    message += "```"
+    await interaction.response.send_message(message)
+    message = await interaction.original_response()
+    for emoji in emojis:
+        await message.add_reaction(emoji)
+
+
+async def setup(client: commands.Bot) -> None:
+    for command in (mock, clapback, quote, ping, code, poll):
+        client.tree.add_command(command)
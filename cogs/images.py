@@ -0,0 +1,110 @@
+"""
+Image generation with Bing, hedged with DALL-E
+"""
+
+import asyncio
+from typing import Literal
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+import jobqueue
+import providers
+import ratelimit
+
+IMAGE_STATUS = {
+    "queued": "Queued with Bing...",
+    "rendering": "Rendering...",
+    "downloading": "Downloading...",
+    "hedging": "Still rendering, asking DALL-E too...",
+}
+
+
+class CancelView(discord.ui.View):
+    """Cancel button for a queued or running image job"""
+
+    def __init__(self, user_id: int) -> None:
+        super().__init__(timeout=None)
+        self.user_id = user_id
+        self.job: jobqueue.Job = None
+
+    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.secondary)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("Only whoever asked for these images can cancel them", ephemeral=True)
+            return
+        await interaction.response.defer()
+        if self.job is not None:
+            bot.IMAGE_QUEUE.cancel(self.job)
+
+
+def image_cost(interaction: discord.Interaction) -> int:
+    """Each requested image counts, so one /image with 4 costs as much as four with 1"""
+    return interaction.namespace.number or 4
+
+
+@app_commands.command(name = "image", description = "Generate an image with Dalle3")
+@app_commands.guilds(*bot.GUILDS)
+@app_commands.describe(prompt="What image to generate")
+@app_commands.describe(number="How many images to generate (must be less than 4)")
+@app_commands.describe(fresh="Optional: Skip the cache and generate new images")
+@ratelimit.limited(bot.RATE_LIMITER, "image", cost=image_cost)
+async def image(interaction: discord.Interaction, prompt : str, number: Literal[1,2,3,4] = 4, fresh: bool = False):
+    if not fresh:
+        cached = await bot.IMAGE_CACHE.get(prompt, number)
+        if cached is not None:
+            # Processing can take longer than Discord's three seconds to first respond
+            await interaction.response.defer()
+            cached = await bot.IMAGE_PROCESSOR.process(cached)
+            await interaction.edit_original_response(attachments=[discord.File(image, filename=image.name) for image in cached])
+            return
+    await interaction.response.defer()
+    pool, scheduler = bot.load_bing()
+    bing = providers.BingProvider(pool, scheduler, **bot.BING_POLLING)
+    dalle = providers.DalleProvider(bot.get_openai())
+    view = CancelView(interaction.user.id)
+
+    async def position(place):
+        await interaction.edit_original_response(content=f"Waiting in line: #{place}", view=view)
+
+    async def progress(stage):
+        await interaction.edit_original_response(content=IMAGE_STATUS[stage], view=view)
+
+    async def run():
+        return await providers.hedged(bing, dalle, prompt, number, hedge_after=bot.IMAGE_HEDGE_AFTER, progress=progress)
+
+    try:
+        view.job = bot.IMAGE_QUEUE.submit(interaction.user.id, interaction.guild_id, run, on_position=position)
+    except jobqueue.QueueFull:
+        await interaction.edit_original_response(content="Too many images are queued right now, try again in a bit")
+        return
+    try:
+        images = await view.job
+    except jobqueue.JobCancelled:
+        await interaction.edit_original_response(content="Cancelled", view=None)
+        return
+    except providers.ProviderFailed as e:
+        await interaction.edit_original_response(view=None)
+        await asyncio.sleep(1)
+        await interaction.followup.send(str(e))
+        return
+    except providers.ProviderUnavailable:
+        await interaction.edit_original_response(content="Image generation is unavailable right now, try again later", view=None)
+        return
+    except Exception:
+        await interaction.edit_original_response(content="Something went wrong generating that image", view=None)
+        raise
+    finally:
+        view.stop()
+    # A DALL-E fallback only ever makes one image; don't serve it to later requests for more
+    if len(images) >= number:
+        await bot.IMAGE_CACHE.put(prompt, number, images)
+    images = await bot.IMAGE_PROCESSOR.process(images)
+    imagefiles = [discord.File(image, filename=image.name) for image in images]
+    await interaction.edit_original_response(content=None, attachments=imagefiles, view=None)
+
+
+async def setup(client: commands.Bot) -> None:
+    client.tree.add_command(image)
@@ -0,0 +1,24 @@
+"""
+One command per asset in media/
+"""
+
+import asyncio
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+
+
+def media_command(asset) -> app_commands.Command:
+    async def send(interaction: discord.Interaction):
+        await bot.MEDIA.send(interaction, asset.command)
+
+    return app_commands.Command(name=asset.command, description=asset.description, callback=send)
+
+
+async def setup(client: commands.Bot) -> None:
+    # Rescanned on every load, so /reload picks up new files
+    for asset in await asyncio.to_thread(bot.MEDIA.scan):
+        client.tree.add_command(media_command(asset), guilds=bot.GUILDS)
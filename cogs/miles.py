@@ -0,0 +1,57 @@
+"""
+Group exercise mileage tracking
+"""
+
+from typing import Literal
+from typing import get_args
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+
+Activity = Literal["Walking", "Running", "Biking", "Skating", "Skiing", "Swimming", "Weightlifting"]
+ACTIVITIES = get_args(Activity)
+
+
+@app_commands.command(name= "miles", description= "Track group exercise miles (send with no arguments to see totals)")
+@app_commands.guilds(*bot.GUILDS)
+@app_commands.describe(activity="What activity you did (on its own: show that activity's leaderboard)")
+@app_commands.describe(distance="How far you went")
+@app_commands.describe(period="Optional: Show this week, month or year instead of all time")
+@app_commands.describe(user="Optional: Show one person's miles")
+async def miles(interaction: discord.Interaction, activity: Activity = None, distance: float = None,
+                period: Literal["all", "week", "month", "year"] = "all", user: discord.User = None):
+    if distance is None:
+        title = "Miles Traveled" if period == "all" else f"Miles Traveled This {period.title()}"
+        if user is not None:
+            totals = await bot.MILES.activity_totals(period, user_id=user.id)
+            embed = discord.Embed(title=title, description=f"Totals for {user.display_name}")
+        elif period == "all":
+            totals = bot.MILES.totals()
+            embed = discord.Embed(title=title, description="Group totals")
+        else:
+            totals = await bot.MILES.activity_totals(period)
+            embed = discord.Embed(title=title, description="Group totals")
+        if activity is None:
+            for name in ACTIVITIES:
+                embed.add_field(name=name, value=str(totals.get(name, 0)), inline=False)
+        else:
+            embed.add_field(name=activity, value=str(totals.get(activity, 0)), inline=False)
+        if user is None:
+            leaders = await bot.MILES.leaderboard(period, activity=activity)
+            if leaders:
+                board = "\n".join(f"{i + 1}. <@{user_id}> - {total:g}" for i, (user_id, total) in enumerate(leaders))
+                embed.add_field(name=f"{activity or 'Overall'} Leaderboard", value=board, inline=False)
+        await interaction.response.send_message(embed=embed)
+        return
+    if activity is None:
+        await interaction.response.send_message("You must select both an activity and a distance", ephemeral=True)
+        return
+    bot.MILES.add(interaction.user.id, activity, distance)
+    await interaction.response.send_message(f"Added {distance} miles to {activity}")
+
+
+async def setup(client: commands.Bot) -> None:
+    client.tree.add_command(miles)
@@ -0,0 +1,51 @@
+"""
+Werewolf channel locking
+"""
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+import bot
+
+
+@app_commands.command(name = "lock", description = "Lock the werewolf channel")
+@app_commands.guilds(bot.WEREWOLF_GUILD_ID)
+@app_commands.checks.has_role(bot.GM_ROLE_ID)
+async def lock(interaction: discord.Interaction):
+    if interaction.user.id != bot.GM_ID:
+        await interaction.response.send_message("Only the GM can lock/unlock the werewolf channel", ephemeral = True)
+        return
+    if interaction.channel.id != bot.WEREWOLF_CHANNEL_ID:
+        await interaction.response.send_message("You can only lock/unlock the werewolf channel", ephemeral=True)
+        return
+    werewolf_guild = bot.client.get_guild(bot.WEREWOLF_GUILD_ID)
+    await interaction.channel.set_permissions(werewolf_guild.default_role, send_messages = False, read_messages = True)
+    await interaction.channel.set_permissions(werewolf_guild.get_role(bot.GM_ROLE_ID), send_messages = True, read_messages = True)
+    await interaction.response.send_message("The channel is now locked")
+    with open("channel_locked.gb", "w") as f:
+        f.write("1")
+    bot.CHANNEL_LOCKED = True
+
+@app_commands.command(name = "unlock", description = "Unlock the werewolf channel")
+@app_commands.guilds(bot.WEREWOLF_GUILD_ID)
+@app_commands.checks.has_role(bot.GM_ROLE_ID)
+async def unlock(interaction: discord.Interaction):
+    if interaction.user.id != bot.GM_ID:
+        await interaction.response.send_message("Only the GM can lock/unlock the werewolf channel", ephemeral = True)
+        return
+    if interaction.channel.id != bot.WEREWOLF_CHANNEL_ID:
+        await interaction.response.send_message("You can only lock/unlock the werewolf channel", ephemeral=True)
+        return
+    werewolf_guild = bot.client.get_guild(bot.WEREWOLF_GUILD_ID)
+    await interaction.channel.set_permissions(werewolf_guild.default_role, send_messages = True, read_messages = True)
+    await interaction.channel.set_permissions(werewolf_guild.get_role(bot.GM_ROLE_ID), send_messages = True, read_messages = True)
+    await interaction.response.send_message("The channel has been unlocked")
+    with open("channel_locked.gb", "w") as f:
+        f.write("0")
+    bot.CHANNEL_LOCKED = False
+
+
+async def setup(client: commands.Bot) -> None:
+    for command in (lock, unlock):
+        client.tree.add_command(command)
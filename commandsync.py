@@ -0,0 +1,73 @@
+"""
+Diff-based slash command sync
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from typing import Dict
+from typing import List
+
+import discord
+from discord import app_commands
+
+import atomicfile
+
+SYNC_CONCURRENCY = 3
+
+
+def tree_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake) -> str:
+    """Hashes the serialized commands registered for a guild"""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get("type", 1), command["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class CommandSync:
+    """
+    Syncs only the guilds whose command tree changed since the last
+    successful sync, a few at a time. The last synced hash per guild is kept
+    on disk so restarts skip unchanged guilds too.
+    Parameters:
+        tree: app_commands.CommandTree
+        guilds: list[discord.Object]
+    Optional Parameters:
+        path: str
+        concurrency: int
+    """
+
+    def __init__(self, tree: app_commands.CommandTree, guilds: List[discord.abc.Snowflake],
+                 path: str = "command_hashes.json", concurrency: int = SYNC_CONCURRENCY) -> None:
+        self.tree = tree
+        self.guilds = guilds
+        self.path = path
+        self.concurrency = concurrency
+        self.failures: Dict[int, Exception] = {}
+        self._hashes: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._hashes = json.load(f)
+
+    def changed(self) -> List[discord.abc.Snowflake]:
+        return [guild for guild in self.guilds if self._hashes.get(str(guild.id)) != tree_hash(self.tree, guild)]
+
+    async def sync(self, force: bool = False) -> List[int]:
+        """
+        Syncs changed guilds (or all of them with force) and returns the ids
+        that were synced. Guilds that fail keep their old hash and are retried
+        next time; their errors are left in failures by guild id rather than
+        raised, so one guild that revoked access can't hold up the rest.
+        """
+        guilds = list(self.guilds) if force else self.changed()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def sync_guild(guild):
+            async with semaphore:
+                await self.tree.sync(guild=guild)
+            self._hashes[str(guild.id)] = tree_hash(self.tree, guild)
+
+        results = await asyncio.gather(*(sync_guild(guild) for guild in guilds), return_exceptions=True)
+        await asyncio.to_thread(atomicfile.write_json, self.path, dict(self._hashes))
+        self.failures = {guild.id: result for guild, result in zip(guilds, results) if isinstance(result, Exception)}
+        return [guild.id for guild in guilds if guild.id not in self.failures]
@@ -0,0 +1,124 @@
+"""
+Token-budgeted assembly of chat context for /respond
+"""
+
+import functools
+import traceback
+from collections import OrderedDict
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+
+TOKEN_BUDGET = 3000
+MAX_MESSAGE_TOKENS = 300
+MESSAGE_OVERHEAD = 4
+CACHE_SIZE = 5000
+
+
+@functools.lru_cache(maxsize=None)
+def encoding():
+    """
+    The tiktoken encoder, loaded on first use since building it is slow;
+    None when tiktoken isn't installed or can't fetch its BPE file, in which
+    case the result is still cached so nothing retries the download
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoder = encoding()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # Roughly four characters per token for English chat
+    return (len(text) + 3) // 4
+
+
+def trim(text: str, max_tokens: int) -> str:
+    """Cuts text down to at most max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoder = encoding()
+    if encoder is not None:
+        tokens = encoder.encode(text, disallowed_special=())
+        return encoder.decode(tokens[:max_tokens]) + "…"
+    return text[:max_tokens * 4] + "…"
+
+
+def format_message(message) -> str:
+    content = message.content
+    for attachment in getattr(message, "attachments", []):
+        content += f" [attachment: {attachment.filename}]"
+    return f"{message.author.name}: {content}"
+
+
+class ContextBuilder:
+    """
+    Packs a channel's chat log, newest first, into a single prompt message
+    within a token budget. Long messages are trimmed and each message's
+    formatted line and token count are memoized.
+    Optional Parameters:
+        budget: int
+        max_message_tokens: int
+    """
+
+    def __init__(self, budget: int = TOKEN_BUDGET, max_message_tokens: int = MAX_MESSAGE_TOKENS) -> None:
+        self.budget = budget
+        self.max_message_tokens = max_message_tokens
+        self._lines: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def line(self, message) -> tuple:
+        """Returns (line, tokens) for a channel message"""
+        key = (message.id, message.edited_at)
+        cached = self._lines.get(key)
+        if cached is not None:
+            self._lines.move_to_end(key)
+            return cached
+        text = trim(format_message(message), self.max_message_tokens)
+        cached = (text, count_tokens(text) + 1)
+        self._lines[key] = cached
+        if len(self._lines) > CACHE_SIZE:
+            self._lines.popitem(last=False)
+        return cached
+
+    async def build(self, system_prompt: str, chat_log: AsyncIterator, prompt: str = None,
+                    summary: str = None) -> List[Dict]:
+        """
+        Builds OpenAI messages from a newest-first async iterator of channel
+        messages, stopping as soon as the budget is spent. A summary of older
+        conversation, if given, goes ahead of the raw chat log.
+        """
+        remaining = self.budget - count_tokens(system_prompt) - MESSAGE_OVERHEAD
+        if summary:
+            summary = trim(f"Summary of the earlier conversation:\n{summary}", self.budget // 3)
+            remaining -= count_tokens(summary) + MESSAGE_OVERHEAD
+        if prompt:
+            prompt = trim(prompt, self.max_message_tokens)
+            remaining -= count_tokens(prompt) + MESSAGE_OVERHEAD
+        remaining -= MESSAGE_OVERHEAD
+        lines = []
+        try:
+            async for message in chat_log:
+                text, tokens = self.line(message)
+                if tokens > remaining:
+                    break
+                lines.append(text)
+                remaining -= tokens
+        finally:
+            if hasattr(chat_log, "aclose"):
+                await chat_log.aclose()
+        messages = [{"role": "user", "content": system_prompt}]
+        if summary:
+            messages.append({"role": "user", "content": summary})
+        if lines:
+            messages.append({"role": "user", "content": "\n".join(reversed(lines))})
+        if prompt:
+            messages.append({"role": "user", "content": prompt})
+        return messages
@@ -0,0 +1,222 @@
+"""
+Health-aware scheduling of Bing auth cookies
+"""
+
+import asyncio
+import datetime
+import time
+from collections import deque
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Type
+from typing import TypeVar
+
+from BingImageCreator import RedirectFailedException
+from BingImageCreator import error_redirect
+from metrics import METRICS
+from metrics import percentile
+
+T = TypeVar("T")
+
+DAILY_QUOTA = 100
+COOLDOWN = 60
+MAX_COOLDOWN = 3600
+FAILURE_WINDOW = 600
+LATENCY_SAMPLES = 50
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 5
+
+
+class CookieStats:
+    """
+    Rolling health record for one cookie
+    """
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.successes = 0
+        self.errors = 0
+        self.redirect_failures = 0
+        self.consecutive_failures = 0
+        self.recent_failures: deque = deque()
+        self.latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.day = datetime.date.today()
+        self.used_today = 0
+
+    def _roll_day(self) -> None:
+        today = datetime.date.today()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def _trim(self, now: float) -> None:
+        while self.recent_failures and now - self.recent_failures[0] > FAILURE_WINDOW:
+            self.recent_failures.popleft()
+
+    @property
+    def success_rate(self) -> float:
+        attempts = self.successes + self.redirect_failures
+        return self.successes / attempts if attempts else 1.0
+
+    def available(self, now: float, daily_quota: int) -> bool:
+        self._roll_day()
+        return now >= self.cooldown_until and self.used_today < daily_quota
+
+    def load(self, now: float) -> Tuple:
+        self._trim(now)
+        median = percentile(self.latencies, 0.5) if self.latencies else 0.0
+        return (self.in_flight, len(self.recent_failures), -self.success_rate, self.used_today, median)
+
+
+class CookieScheduler:
+    """
+    Picks the least-loaded healthy cookie for each job, cools down cookies
+    whose redirects fail, and optionally hedges slow jobs onto a second cookie.
+    Hedging is off by default: each hedge spends another cookie's daily quota.
+    Parameters:
+        cookies: list[str]
+    Optional Parameters:
+        daily_quota: int
+        hedge: bool
+        retry_on: tuple of exceptions that count against the cookie
+    """
+
+    def __init__(
+        self,
+        cookies: List[str],
+        daily_quota: int = DAILY_QUOTA,
+        hedge: bool = False,
+        retry_on: Tuple[Type[BaseException], ...] = (RedirectFailedException,),
+    ) -> None:
+        self.cookies = list(cookies)
+        self.daily_quota = daily_quota
+        self.hedge = hedge
+        self.retry_on = retry_on
+        self._stats: Dict[str, CookieStats] = {
+            cookie: CookieStats(f"cookie {i + 1}") for i, cookie in enumerate(self.cookies)
+        }
+
+    def pick(self, exclude=()) -> str:
+        """
+        Returns the healthiest available cookie, or None if all are cooling down
+        """
+        now = time.monotonic()
+        candidates = [
+            cookie for cookie in self.cookies
+            if cookie not in exclude and self._stats[cookie].available(now, self.daily_quota)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda cookie: self._stats[cookie].load(now))
+
+    def hedge_delay(self) -> float:
+        """
+        Latency after which a second attempt is started, or None without enough history
+        """
+        samples = [latency for stats in self._stats.values() for latency in stats.latencies]
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, HEDGE_PERCENTILE)
+
+    async def _attempt(self, cookie: str, job: Callable[[str], Awaitable[T]]) -> T:
+        stats = self._stats[cookie]
+        stats.in_flight += 1
+        stats.used_today += 1
+        start = time.monotonic()
+        try:
+            result = await job(cookie)
+        except self.retry_on:
+            now = time.monotonic()
+            stats.redirect_failures += 1
+            stats.consecutive_failures += 1
+            stats.recent_failures.append(now)
+            cooldown = min(COOLDOWN * 2 ** (stats.consecutive_failures - 1), MAX_COOLDOWN)
+            stats.cooldown_until = now + cooldown
+            METRICS.increment("bing_redirect_failures", cookie=stats.label)
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.in_flight -= 1
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.latencies.append(time.monotonic() - start)
+        METRICS.observe("bing_cookie_seconds", stats.latencies[-1], cookie=stats.label)
+        return result
+
+    async def run(self, job: Callable[[str], Awaitable[T]]) -> T:
+        """
+        Runs job(cookie) until one attempt succeeds, moving to the next cookie
+        on retryable failures. Raises the last retryable error once no healthy
+        cookie is left.
+        """
+        tried = set()
+        pending: Dict[asyncio.Task, float] = {}
+        last_error = None
+        can_hedge = self.hedge
+        try:
+            while True:
+                if not pending:
+                    cookie = self.pick(exclude=tried)
+                    if cookie is None:
+                        raise last_error or RedirectFailedException(error_redirect)
+                    tried.add(cookie)
+                    pending[asyncio.ensure_future(self._attempt(cookie, job))] = time.monotonic()
+                timeout = None
+                delay = self.hedge_delay()
+                if can_hedge and len(pending) == 1 and delay is not None:
+                    started = next(iter(pending.values()))
+                    timeout = max(started + delay - time.monotonic(), 0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    cookie = self.pick(exclude=tried)
+                    if cookie is None:
+                        can_hedge = False
+                        continue
+                    tried.add(cookie)
+                    METRICS.increment("bing_hedged_requests")
+                    pending[asyncio.ensure_future(self._attempt(cookie, job))] = time.monotonic()
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if not isinstance(error, self.retry_on):
+                        raise error
+                    last_error = error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> List[Dict]:
+        """
+        Per-cookie health summary, labelled by position so cookies never leak
+        """
+        now = time.monotonic()
+        summary = []
+        for cookie in self.cookies:
+            stats = self._stats[cookie]
+            stats._trim(now)
+            stats._roll_day()
+            summary.append({
+                "label": stats.label,
+                "success_rate": stats.success_rate,
+                "successes": stats.successes,
+                "redirect_failures": stats.redirect_failures,
+                "recent_failures": len(stats.recent_failures),
+                "errors": stats.errors,
+                "in_flight": stats.in_flight,
+                "used_today": stats.used_today,
+                "p50": percentile(stats.latencies, 0.5) if stats.latencies else None,
+                "cooldown": max(stats.cooldown_until - now, 0),
+            })
+        return summary
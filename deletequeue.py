@@ -0,0 +1,114 @@
+"""
+Batched message deletion for the locked werewolf channel
+"""
+
+import asyncio
+import datetime
+import time
+import traceback
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import discord
+
+FLUSH_INTERVAL = 1.0
+MAX_INTERVAL = 10.0
+BULK_LIMIT = 100
+# Bulk delete rejects messages older than 14 days; leave a margin for clock skew
+BULK_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+
+class DeletionQueue:
+    """
+    Collects messages to delete and flushes them per channel on a short
+    timer, using bulk delete where Discord allows it and single deletes for
+    messages too old for it. discord.py already waits out rate-limit buckets
+    from the response headers, so a flush that runs long means we are being
+    limited; the flush interval backs off accordingly and recovers when
+    flushes are quick again.
+    Optional Parameters:
+        interval: float
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL) -> None:
+        self.base_interval = interval
+        self.interval = interval
+        self.deleted = 0
+        self.failed = 0
+        self.last_flush_duration = 0.0
+        self._pending: Dict[int, List[Tuple[discord.Message, float]]] = {}
+        self._channels: Dict[int, discord.abc.Messageable] = {}
+        self._worker: asyncio.Task = None
+
+    def add(self, message: discord.Message) -> None:
+        self._channels[message.channel.id] = message.channel
+        self._pending.setdefault(message.channel.id, []).append((message, time.monotonic()))
+
+    @property
+    def depth(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest queued message has been waiting"""
+        oldest = [items[0][1] for items in self._pending.values() if items]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def flush(self) -> None:
+        if not self.depth:
+            return
+        start = time.monotonic()
+        pending, self._pending = self._pending, {}
+        for channel_id, items in pending.items():
+            await self._flush_channel(self._channels[channel_id], [message for message, _ in items])
+        self.last_flush_duration = time.monotonic() - start
+        if self.last_flush_duration > self.interval:
+            self.interval = min(self.interval * 2, MAX_INTERVAL)
+        else:
+            self.interval = max(self.interval / 2, self.base_interval)
+
+    async def _flush_channel(self, channel, messages: List[discord.Message]) -> None:
+        cutoff = discord.utils.utcnow() - BULK_MAX_AGE
+        recent = [m for m in messages if m.created_at > cutoff]
+        old = [m for m in messages if m.created_at <= cutoff]
+        for i in range(0, len(recent), BULK_LIMIT):
+            batch = recent[i:i + BULK_LIMIT]
+            try:
+                await channel.delete_messages(batch)
+                self.deleted += len(batch)
+            except discord.NotFound:
+                # Someone else removed one of them first; fall back to one at a time
+                old.extend(batch)
+            except discord.HTTPException:
+                self.failed += len(batch)
+        for message in old:
+            try:
+                await message.delete()
+                self.deleted += 1
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                self.failed += 1
+
+    def stats(self) -> Dict:
+        return {
+            "depth": self.depth,
+            "lag": self.lag,
+            "interval": self.interval,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "last_flush": self.last_flush_duration,
+        }
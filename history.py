@@ -0,0 +1,133 @@
+"""
+Per-channel ring buffers of recent messages, kept current from gateway events
+"""
+
+import asyncio
+from collections import deque
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Union
+
+import discord
+
+BUFFER_SIZE = 200
+
+
+class MessageBuffer:
+    """
+    Bounded recent-message buffers per channel. Channels are backfilled from
+    the API on first use and then kept in sync by on_message and the raw
+    edit/delete events; reads only go back to the API when the buffer cannot
+    cover them.
+    Optional Parameters:
+        size: int
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE) -> None:
+        self.size = size
+        self._channels: Dict[int, deque] = {}
+        self._backfilled = set()
+        self._exhaustive = set()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _buffer(self, channel_id: int) -> deque:
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            buffer = self._channels[channel_id] = deque(maxlen=self.size)
+        return buffer
+
+    def add(self, message: discord.Message) -> None:
+        buffer = self._buffer(message.channel.id)
+        if buffer and buffer[-1].id > message.id:
+            self._merge(message.channel.id, [message])
+            return
+        if len(buffer) == buffer.maxlen:
+            # The oldest message falls out, so the buffer no longer holds the whole channel
+            self._exhaustive.discard(message.channel.id)
+        buffer.append(message)
+
+    def edit(self, channel_id: int, message: discord.Message) -> None:
+        buffer = self._channels.get(channel_id)
+        if not buffer:
+            return
+        for i, m in enumerate(buffer):
+            if m.id == message.id:
+                buffer[i] = message
+                return
+
+    def delete(self, channel_id: int, message_ids) -> None:
+        buffer = self._channels.get(channel_id)
+        if not buffer:
+            return
+        message_ids = set(message_ids)
+        kept = [m for m in buffer if m.id not in message_ids]
+        if len(kept) != len(buffer):
+            buffer.clear()
+            buffer.extend(kept)
+
+    def _merge(self, channel_id: int, messages: List[discord.Message]) -> None:
+        buffer = self._buffer(channel_id)
+        merged = {m.id: m for m in messages}
+        # Messages seen live are at least as fresh as fetched copies
+        merged.update((m.id, m) for m in buffer)
+        if len(merged) > self.size:
+            self._exhaustive.discard(channel_id)
+        buffer.clear()
+        buffer.extend(merged[i] for i in sorted(merged)[-self.size:])
+
+    async def _backfill(self, channel) -> None:
+        if channel.id in self._backfilled:
+            return
+        lock = self._locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            if channel.id in self._backfilled:
+                return
+            fetched = [m async for m in channel.history(limit=self.size)]
+            self._merge(channel.id, fetched)
+            if len(fetched) < self.size:
+                self._exhaustive.add(channel.id)
+            self._backfilled.add(channel.id)
+
+    async def recent(self, channel, limit: Union[int, None]) -> List[discord.Message]:
+        """
+        Returns up to limit of the newest messages in a channel, oldest first.
+        limit=None means the whole channel.
+        """
+        if limit is not None and limit <= self.size:
+            await self._backfill(channel)
+            buffer = self._channels[channel.id]
+            if len(buffer) >= limit or channel.id in self._exhaustive:
+                return list(buffer)[-limit:] if limit else []
+        return [m async for m in channel.history(limit=limit, oldest_first=False)][::-1]
+
+    async def iter_recent(self, channel, limit: Union[int, None], after: int = 0) -> AsyncIterator[discord.Message]:
+        """
+        Yields up to limit messages newer than the after id, newest first,
+        continuing into the API only once the buffered messages run out.
+        limit=None means the whole channel.
+        """
+        await self._backfill(channel)
+        buffered = [m for m in reversed(self._channels[channel.id]) if m.id > after]
+        if limit is not None:
+            buffered = buffered[:limit]
+        for message in buffered:
+            yield message
+        if channel.id in self._exhaustive or (limit is not None and len(buffered) >= limit):
+            return
+        oldest = self._channels[channel.id][0].id if self._channels[channel.id] else None
+        if oldest is not None and oldest <= after:
+            return
+        remaining = None if limit is None else limit - len(buffered)
+        before = discord.Object(id=buffered[-1].id) if buffered else None
+        older = channel.history(
+            limit=remaining,
+            before=before,
+            after=discord.Object(id=after) if after else None,
+            oldest_first=False,
+        )
+        async for message in older:
+            yield message
+
+    async def latest(self, channel) -> discord.Message:
+        return (await self.recent(channel, 1))[-1]
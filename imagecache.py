@@ -0,0 +1,152 @@
+"""
+Content-addressed cache of generated images, keyed by normalized prompt and count
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import List
+from typing import Union
+
+MAX_BYTES = 512 * 1024 * 1024
+TTL = 7 * 24 * 3600
+
+
+def normalize(prompt: str) -> str:
+    return " ".join(prompt.casefold().split())
+
+
+def cache_key(prompt: str, count: int) -> str:
+    return hashlib.sha256(f"{count}|{normalize(prompt)}".encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, names: List[str], size: int, created: float) -> None:
+        self.names = names
+        self.size = size
+        self.created = created
+
+
+class ImageCache:
+    """
+    Stores image bytes on disk under directory/<key>/ with an in-memory LRU
+    index bounded by total bytes and entry age
+    Optional Parameters:
+        directory: str
+        max_bytes: int
+        ttl: float (seconds)
+    """
+
+    def __init__(self, directory: str = "image_cache", max_bytes: int = MAX_BYTES, ttl: float = TTL) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._index: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._writing = set()
+        self._load()
+
+    def _load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith(".") or not os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            names = sorted(os.listdir(path))
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in names)
+            entries.append((os.path.getmtime(path), key, names, size))
+        for created, key, names, size in sorted(entries):
+            self._index[key] = CacheEntry(names, size, created)
+            self.total_bytes += size
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.created > self.ttl
+
+    def _read(self, key: str, names: List[str]) -> List[BytesIO]:
+        images = []
+        for name in names:
+            with open(os.path.join(self.directory, key, name), "rb") as f:
+                image = BytesIO(f.read())
+            image.name = name
+            images.append(image)
+        return images
+
+    def _write(self, key: str, images: List[BytesIO]) -> Union[List[str], None]:
+        """Returns the stored file names, or None if the entry couldn't be moved into place"""
+        staging = os.path.join(self.directory, f".{key}.{os.getpid()}.{id(images)}")
+        os.makedirs(staging, exist_ok=True)
+        names = []
+        for image in images:
+            with open(os.path.join(staging, image.name), "wb") as f:
+                f.write(image.getbuffer())
+            names.append(image.name)
+        try:
+            os.replace(staging, os.path.join(self.directory, key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return None
+        return names
+
+    async def _evict(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry.size
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.directory, key), ignore_errors=True)
+
+    async def get(self, prompt: str, count: int) -> Union[List[BytesIO], None]:
+        """
+        Returns the cached images for a prompt, or None on a miss
+        """
+        key = cache_key(prompt, count)
+        entry = self._index.get(key)
+        if entry is not None and self._expired(entry):
+            await self._evict(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        try:
+            images = await asyncio.to_thread(self._read, key, entry.names)
+        except OSError:
+            await self._evict(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return images
+
+    async def put(self, prompt: str, count: int, images: List[BytesIO]) -> None:
+        """
+        Stores images for a prompt, evicting expired and least recently used entries
+        """
+        key = cache_key(prompt, count)
+        size = sum(image.getbuffer().nbytes for image in images)
+        # Another put for the same prompt is already storing it
+        if size > self.max_bytes or key in self._writing:
+            return
+        self._writing.add(key)
+        try:
+            if key in self._index:
+                await self._evict(key)
+            names = await asyncio.to_thread(self._write, key, images)
+        finally:
+            self._writing.discard(key)
+        for image in images:
+            image.seek(0)
+        if names is None:
+            return
+        self._index[key] = CacheEntry(names, size, time.time())
+        self.total_bytes += size
+        for k in [k for k, entry in self._index.items() if self._expired(entry)]:
+            await self._evict(k)
+        while self.total_bytes > self.max_bytes:
+            await self._evict(next(iter(self._index)))
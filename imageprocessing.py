@@ -0,0 +1,183 @@
+"""
+Collage and re-encoding of generated images before upload
+"""
+
+import asyncio
+import multiprocessing
+import traceback
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List
+
+from metrics import METRICS
+
+MODES = ("grid", "thumbnails", "off")
+MAX_SIZE = 1536
+THUMBNAIL_SIZE = 512
+IMAGE_FORMAT = "webp"
+QUALITY = 82
+WORKERS = 2
+LABEL_SCALE = 0.06
+
+
+def _encode(image, image_format: str, quality: int) -> bytes:
+    out = BytesIO()
+    if image_format == "jpeg":
+        image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(out, format="WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def _font(size: int):
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow before 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def render_grid(images: List[bytes], max_size: int, image_format: str, quality: int) -> bytes:
+    """
+    Runs in a worker process. Lays up to four images out in a 2×2 grid
+    (one image is just re-encoded), numbers each tile in its corner, and
+    scales the whole grid down so its longest side is at most max_size.
+    """
+    from PIL import Image
+    from PIL import ImageDraw
+    from PIL import ImageOps
+
+    tiles = [Image.open(BytesIO(data)).convert("RGB") for data in images]
+    columns = 1 if len(tiles) == 1 else 2
+    rows = (len(tiles) + columns - 1) // columns
+    tile_width = max(tile.width for tile in tiles)
+    tile_height = max(tile.height for tile in tiles)
+    scale = min(1.0, max_size / max(columns * tile_width, rows * tile_height))
+    tile_width, tile_height = max(int(tile_width * scale), 1), max(int(tile_height * scale), 1)
+    grid = Image.new("RGB", (columns * tile_width, rows * tile_height), "black")
+    draw = ImageDraw.Draw(grid)
+    font = _font(max(int(tile_height * LABEL_SCALE), 10))
+    for i, tile in enumerate(tiles):
+        tile = ImageOps.contain(tile, (tile_width, tile_height), Image.LANCZOS)
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        grid.paste(tile, (x + (tile_width - tile.width) // 2, y + (tile_height - tile.height) // 2))
+        if len(tiles) > 1:
+            left, top, right, bottom = draw.textbbox((0, 0), str(i + 1), font=font)
+            pad = max((bottom - top) // 3, 2)
+            draw.rectangle((x, y, x + right - left + 2 * pad, y + bottom - top + 2 * pad), fill="black")
+            draw.text((x + pad - left, y + pad - top), str(i + 1), fill="white", font=font)
+    return _encode(grid, image_format, quality)
+
+
+def _load() -> None:
+    from PIL import Image  # noqa: F401
+
+
+def render_thumbnails(images: List[bytes], size: int, image_format: str, quality: int) -> List[bytes]:
+    """Runs in a worker process. Shrinks each image to fit in size×size and re-encodes it."""
+    from PIL import Image
+
+    thumbnails = []
+    for data in images:
+        image = Image.open(BytesIO(data)).convert("RGB")
+        image.thumbnail((size, size), Image.LANCZOS)
+        thumbnails.append(_encode(image, image_format, quality))
+    return thumbnails
+
+
+class ImageProcessor:
+    """
+    Optionally turns generated images into something lighter to upload: a
+    single numbered grid, or one thumbnail per image. Off by default. The
+    PIL work runs in a process pool so it never blocks the event loop.
+    The workers are forked, so start() has to be called before the process
+    has any other threads; a pool that breaks later isn't re-forked and the
+    originals are sent from then on. The originals are also sent if PIL is
+    missing or an image can't be decoded.
+    Optional Parameters:
+        mode: str ("grid", "thumbnails" or "off")
+        max_size: int (longest side of the grid in pixels)
+        thumbnail_size: int (longest side of each thumbnail in pixels)
+        image_format: str ("webp" or "jpeg")
+        quality: int (1-100)
+        workers: int
+    """
+
+    def __init__(self, mode: str = "off", max_size: int = MAX_SIZE, thumbnail_size: int = THUMBNAIL_SIZE,
+                 image_format: str = IMAGE_FORMAT, quality: int = QUALITY, workers: int = WORKERS) -> None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if image_format not in ("webp", "jpeg"):
+            raise ValueError("image_format must be webp or jpeg")
+        self.mode = mode
+        self.max_size = max_size
+        self.thumbnail_size = thumbnail_size
+        self.image_format = image_format
+        self.quality = quality
+        self.workers = workers
+        self._executor: ProcessPoolExecutor = None
+        self._loading: List[Future] = []
+
+    def start(self) -> None:
+        """
+        Forks the workers and starts importing PIL in them. With fork the
+        first submit launches every worker before the pool's own manager
+        thread, so this is safe as long as nothing else has started a thread.
+        """
+        if self.mode == "off" or self._executor is not None:
+            return
+        # Fork where we can: spawned workers would re-run bot.py as their main module
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork") if "fork" in methods else None
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self._loading = [self._executor.submit(_load) for _ in range(self.workers)]
+
+    async def warm_up(self) -> None:
+        """Waits for the workers to import PIL, and gives up on the pool if they can't"""
+        try:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in self._loading))
+        except (ImportError, BrokenProcessPool):
+            traceback.print_exc()
+            self.shutdown()
+        self._loading = []
+
+    async def process(self, images: List[BytesIO]) -> List[BytesIO]:
+        """Returns the files to upload in place of images"""
+        if self.mode == "off" or self._executor is None or not images:
+            return images
+        data = [image.getvalue() for image in images]
+        loop = asyncio.get_running_loop()
+        try:
+            with METRICS.timer("image_process_seconds", mode=self.mode):
+                if self.mode == "grid":
+                    bodies = [await loop.run_in_executor(
+                        self._executor, render_grid, data, self.max_size, self.image_format, self.quality
+                    )]
+                else:
+                    bodies = await loop.run_in_executor(
+                        self._executor, render_thumbnails, data, self.thumbnail_size, self.image_format, self.quality
+                    )
+        except BrokenProcessPool:
+            traceback.print_exc()
+            self.shutdown()
+            return images
+        except (ImportError, OSError):
+            traceback.print_exc()
+            return images
+        METRICS.increment("image_upload_bytes", sum(len(body) for body in data), stage="original")
+        METRICS.increment("image_upload_bytes", sum(len(body) for body in bodies), stage=self.mode)
+        extension = "jpg" if self.image_format == "jpeg" else "webp"
+        files = []
+        for i, body in enumerate(bodies):
+            file = BytesIO(body)
+            file.name = f"grid.{extension}" if self.mode == "grid" else f"{i}.{extension}"
+            files.append(file)
+        return files
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
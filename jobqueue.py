@@ -0,0 +1,254 @@
+"""
+Fair, bounded job queue for slow backend work like /image
+"""
+
+import asyncio
+import time
+import traceback
+from collections import deque
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from metrics import METRICS
+
+CONCURRENCY = 2
+MAX_QUEUED = 50
+MAX_PER_USER = 3
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    One queued unit of work. Await it for the result; raises JobCancelled if
+    it was cancelled, or whatever the work itself raised.
+    """
+
+    def __init__(self, user_id: int, guild_id: int, run: Callable[[], Awaitable[Any]],
+                 on_position: Callable[[int], Awaitable[None]] = None) -> None:
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.run = run
+        self.on_position = on_position
+        self.position = None
+        self.enqueued = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task = None
+        self.sequence = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class JobQueue:
+    """
+    Runs at most `concurrency` jobs at once. Waiting jobs are started
+    round-robin across guilds, and within a guild round-robin across users,
+    so one busy user or server can't starve the rest. The rotation is kept
+    by remembering when each guild and user was last served, so someone
+    whose job started straight away still waits their turn for the next
+    one. Each waiting job is told its 1-based position whenever it changes.
+    Optional Parameters:
+        name: str (metric prefix)
+        concurrency: int
+        max_queued: int (waiting jobs before submit raises QueueFull)
+        max_per_user: int (waiting or running jobs per user)
+    """
+
+    def __init__(self, name: str = "jobs", concurrency: int = CONCURRENCY,
+                 max_queued: int = MAX_QUEUED, max_per_user: int = MAX_PER_USER) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.completed = 0
+        self.cancelled = 0
+        # guild id -> user id -> that user's waiting jobs
+        self._waiting: Dict[int, Dict[int, deque]] = {}
+        self._running: set = set()
+        # When each guild and (guild, user) was last served; never served sorts first
+        self._guild_served: Dict[int, int] = {}
+        self._user_served: Dict[Tuple[int, int], int] = {}
+        self._served = 0
+        self._submitted = 0
+        self._notifiers: set = set()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(jobs) for users in self._waiting.values() for jobs in users.values())
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def _user_jobs(self, user_id: int) -> int:
+        waiting = sum(len(users.get(user_id, ())) for users in self._waiting.values())
+        return waiting + sum(1 for job in self._running if job.user_id == user_id)
+
+    def submit(self, user_id: int, guild_id: int, run: Callable[[], Awaitable[Any]],
+               on_position: Callable[[int], Awaitable[None]] = None) -> Job:
+        """Queues run() and returns its Job; raises QueueFull past the limits"""
+        if self.depth >= self.max_queued or self._user_jobs(user_id) >= self.max_per_user:
+            METRICS.increment(f"{self.name}_rejected")
+            raise QueueFull()
+        job = Job(user_id, guild_id, run, on_position)
+        job.sequence = self._submitted
+        self._submitted += 1
+        users = self._waiting.setdefault(guild_id, {})
+        users.setdefault(user_id, deque()).append(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Cancels a waiting or running job; False if it already finished"""
+        if job.future.done():
+            return False
+        if job.running:
+            job.task.cancel()
+            return True
+        users = self._waiting[job.guild_id]
+        users[job.user_id].remove(job)
+        self._prune(job.guild_id, job.user_id)
+        self.cancelled += 1
+        METRICS.increment(f"{self.name}_cancelled")
+        job.future.set_exception(JobCancelled())
+        self._dispatch()
+        return True
+
+    @staticmethod
+    def _pick(waiting: Dict[int, Dict[int, deque]], guild_served: Dict[int, int],
+              user_served: Dict[Tuple[int, int], int]) -> Tuple[int, int]:
+        """The least recently served guild, then its least recently served user; ties go to whoever queued first"""
+        def guild_rank(guild_id):
+            head = min(jobs[0].sequence for jobs in waiting[guild_id].values())
+            return guild_served.get(guild_id, -1), head
+
+        guild_id = min(waiting, key=guild_rank)
+        users = waiting[guild_id]
+        user_id = min(users, key=lambda user_id: (user_served.get((guild_id, user_id), -1), users[user_id][0].sequence))
+        return guild_id, user_id
+
+    def order(self) -> List[Job]:
+        """Waiting jobs in the order they'll start"""
+        waiting = {guild_id: {user_id: deque(jobs) for user_id, jobs in users.items()}
+                   for guild_id, users in self._waiting.items()}
+        guild_served = dict(self._guild_served)
+        user_served = dict(self._user_served)
+        served = self._served
+        order = []
+        while waiting:
+            guild_id, user_id = self._pick(waiting, guild_served, user_served)
+            order.append(waiting[guild_id][user_id].popleft())
+            guild_served[guild_id] = user_served[(guild_id, user_id)] = served
+            served += 1
+            if not waiting[guild_id][user_id]:
+                del waiting[guild_id][user_id]
+            if not waiting[guild_id]:
+                del waiting[guild_id]
+        return order
+
+    def _next(self) -> Job:
+        if not self._waiting:
+            return None
+        guild_id, user_id = self._pick(self._waiting, self._guild_served, self._user_served)
+        job = self._waiting[guild_id][user_id].popleft()
+        self._guild_served[guild_id] = self._user_served[(guild_id, user_id)] = self._served
+        self._served += 1
+        self._prune(guild_id, user_id)
+        return job
+
+    def _prune(self, guild_id: int, user_id: int) -> None:
+        users = self._waiting[guild_id]
+        if not users[user_id]:
+            del users[user_id]
+        if not users:
+            del self._waiting[guild_id]
+
+    def _forget_idle(self) -> None:
+        """
+        Drops last-served stamps of guilds and users with no jobs, but only
+        ones older than every active stamp: forgetting those can't change
+        the order, since never served sorts first anyway.
+        """
+        users = {(job.guild_id, job.user_id) for job in self._running}
+        users.update((guild_id, user_id) for guild_id, waiting in self._waiting.items() for user_id in waiting)
+        guilds = {guild_id for guild_id, _ in users}
+        for stamps, active in ((self._user_served, users), (self._guild_served, guilds)):
+            oldest = min((stamps[key] for key in active if key in stamps), default=None)
+            for key in [key for key, stamp in stamps.items() if key not in active]:
+                if oldest is None or stamps[key] < oldest:
+                    del stamps[key]
+
+    def _dispatch(self) -> None:
+        while len(self._running) < self.concurrency:
+            job = self._next()
+            if job is None:
+                break
+            self._start(job)
+        self._forget_idle()
+        for position, job in enumerate(self.order(), start=1):
+            if job.position != position:
+                job.position = position
+                if job.on_position is not None:
+                    notifier = asyncio.ensure_future(self._notify(job, position))
+                    self._notifiers.add(notifier)
+                    notifier.add_done_callback(self._notifiers.discard)
+        METRICS.set(f"{self.name}_queue_depth", self.depth)
+        METRICS.set(f"{self.name}_running", len(self._running))
+
+    def _start(self, job: Job) -> None:
+        METRICS.observe(f"{self.name}_queue_wait_seconds", time.monotonic() - job.enqueued)
+        job.position = 0
+        job.task = asyncio.ensure_future(job.run())
+        self._running.add(job)
+        job.task.add_done_callback(lambda task: self._finished(job, task))
+
+    def _finished(self, job: Job, task: asyncio.Task) -> None:
+        self._running.discard(job)
+        if task.cancelled():
+            self.cancelled += 1
+            METRICS.increment(f"{self.name}_cancelled")
+            job.future.set_exception(JobCancelled())
+        elif task.exception() is not None:
+            job.future.set_exception(task.exception())
+        else:
+            self.completed += 1
+            job.future.set_result(task.result())
+        self._dispatch()
+
+    @staticmethod
+    async def _notify(job: Job, position: int) -> None:
+        # Positions can change faster than the edits land; skip stale ones
+        if job.position != position:
+            return
+        try:
+            await job.on_position(position)
+        except Exception:
+            traceback.print_exc()
+
+    def stats(self) -> Dict:
+        waits = [time.monotonic() - job.enqueued for job in self.order()]
+        return {
+            "depth": self.depth,
+            "running": len(self._running),
+            "concurrency": self.concurrency,
+            "guilds": len(self._waiting),
+            "users": len({job.user_id for job in self.order()}),
+            "oldest": max(waits, default=0.0),
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+        }
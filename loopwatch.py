@@ -0,0 +1,188 @@
+"""
+Event loop lag monitor that catches whatever is blocking the loop
+"""
+
+import asyncio
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+from types import CodeType
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from metrics import METRICS
+
+INTERVAL = 0.1
+THRESHOLD = 0.5
+REPORT_COOLDOWN = 300
+SLOW_CALLBACK = 0.1
+STACK_LIMIT = 30
+ADDRESS = re.compile(r" at 0x[0-9a-f]+")
+
+
+class Stall:
+    """The loop thread's stack, captured by the watcher while the loop was stuck"""
+
+    def __init__(self, beat: float, stack: traceback.StackSummary, codes: List[CodeType]) -> None:
+        self.beat = beat
+        self.stack = stack
+        self.codes = codes
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Forwards asyncio's debug-mode "Executing ... took N seconds" warnings"""
+
+    def __init__(self, watchdog: "LoopWatchdog") -> None:
+        super().__init__(logging.WARNING)
+        self.watchdog = watchdog
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not str(record.msg).startswith("Executing"):
+            return
+        message = record.getMessage()
+        self.watchdog.loop.call_soon_threadsafe(self.watchdog._slow_callback, message)
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag with a heartbeat task that should wake every
+    interval seconds. A watcher thread notices when the heartbeat is more
+    than threshold seconds overdue and snapshots the loop thread's stack
+    while it is still stuck. Once the loop recovers, the stall is reported
+    with how long it lasted and which command's callback was on the stack.
+    Repeats from the same place are reported at most once per cooldown.
+    Parameters:
+        report: async callable taking the message to send
+    Optional Parameters:
+        commands: callable returning {callback code object: command name}
+        interval: float (seconds)
+        threshold: float (seconds of lag before a stall is reported)
+        cooldown: float (seconds)
+    """
+
+    def __init__(self, report: Callable[[str], Awaitable[None]],
+                 commands: Callable[[], Dict[CodeType, str]] = None, interval: float = INTERVAL,
+                 threshold: float = THRESHOLD, cooldown: float = REPORT_COOLDOWN) -> None:
+        self.report = report
+        self.commands = commands
+        self.interval = interval
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stalls = 0
+        self.worst = 0.0
+        self._beat = time.monotonic()
+        self._thread_id: int = None
+        self._stall: Stall = None
+        self._reported: Dict[str, float] = {}
+        self._task: asyncio.Task = None
+        self._watcher: threading.Thread = None
+        self._handler: _SlowCallbackHandler = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watcher.start()
+
+    async def _run(self) -> None:
+        while True:
+            beat = self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - beat - self.interval, 0.0)
+            METRICS.observe("loop_lag_seconds", lag)
+            stall, self._stall = self._stall, None
+            if lag < self.threshold:
+                continue
+            if stall is not None and stall.beat != beat:
+                stall = None
+            try:
+                await self._stalled(lag, stall)
+            except Exception:
+                traceback.print_exc()
+
+    def _watch(self) -> None:
+        """Runs in the watcher thread, so it still runs while the loop is stuck"""
+        while True:
+            time.sleep(self.interval)
+            beat = self._beat
+            if self._stall is not None or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            self._stall = Stall(beat, stack, codes)
+
+    def _command(self, codes: List[CodeType]) -> str:
+        callbacks = self.commands() if self.commands is not None else {}
+        return next((callbacks[code] for code in codes if code in callbacks), None)
+
+    async def _stalled(self, lag: float, stall: Stall) -> None:
+        self.stalls += 1
+        self.worst = max(self.worst, lag)
+        command = self._command(stall.codes) if stall is not None else None
+        METRICS.increment("loop_stalls", command=command or "none")
+        where = f" in /{command}" if command else ""
+        if stall is None:
+            key = f"{command}:unknown"
+            detail = "(recovered before the stack could be captured)"
+        else:
+            top = stall.stack[-1]
+            key = f"{command}:{top.filename}:{top.lineno}"
+            detail = f"```\n{''.join(stall.stack.format())}```"
+        if not self._cooled_down(key):
+            return
+        await self.report(f"Event loop blocked for {lag:.2f}s{where}\n{detail}")
+
+    def _cooled_down(self, key: str) -> bool:
+        now = time.monotonic()
+        if now - self._reported.get(key, -self.cooldown) < self.cooldown:
+            return False
+        self._reported[key] = now
+        return True
+
+    def _slow_callback(self, message: str) -> None:
+        if self._cooled_down(ADDRESS.sub("", message)):
+            asyncio.ensure_future(self.report(f"Slow callback: {message}"))
+
+    def set_debug(self, enabled: bool, slow_callback: float = SLOW_CALLBACK) -> None:
+        """
+        Turns asyncio debug mode on or off for the running loop. While on,
+        every callback slower than slow_callback seconds is logged by asyncio
+        and reported. Debug mode has a real overhead, so leave it on only
+        while hunting something down.
+        """
+        self.loop = self.loop or asyncio.get_running_loop()
+        self.loop.set_debug(enabled)
+        self.loop.slow_callback_duration = slow_callback
+        logger = logging.getLogger("asyncio")
+        if enabled and self._handler is None:
+            self._handler = _SlowCallbackHandler(self)
+            logger.addHandler(self._handler)
+        elif not enabled and self._handler is not None:
+            logger.removeHandler(self._handler)
+            self._handler = None
+
+    def stats(self) -> Dict:
+        return {
+            "stalls": self.stalls,
+            "worst": self.worst,
+            "threshold": self.threshold,
+            "debug": self.loop is not None and self.loop.get_debug(),
+            "slow_callback": self.loop.slow_callback_duration if self.loop is not None else SLOW_CALLBACK,
+        }
@@ -0,0 +1,145 @@
+"""
+Meme assets from media/, uploaded once and then resent by CDN link
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from io import BytesIO
+from typing import Dict
+from typing import List
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import discord
+
+import atomicfile
+from metrics import METRICS
+
+MEDIA_DIR = "media"
+MANIFEST = "media.json"
+MEDIA_EXTENSIONS = (".gif", ".png", ".jpg", ".jpeg", ".webp", ".mp4", ".webm", ".mov")
+# Revalidate links this long before Discord's signature runs out
+REFRESH_MARGIN = 3600
+COMMAND_CHARACTERS = re.compile(r"[^a-z0-9_-]+")
+
+
+def command_name(filename: str) -> str:
+    stem = os.path.splitext(filename)[0].lower()
+    return COMMAND_CHARACTERS.sub("_", stem).strip("_")[:32]
+
+
+def expiry(url: str) -> float:
+    """
+    When a signed Discord CDN link stops working, from its ex= parameter
+    (hex unix seconds). Unsigned links never expire.
+    """
+    values = parse_qs(urlparse(url).query).get("ex")
+    try:
+        return float(int(values[0], 16))
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+class MediaAsset:
+    def __init__(self, filename: str, command: str, description: str, data: bytes) -> None:
+        self.filename = filename
+        self.command = command
+        self.description = description
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+
+
+class MediaRegistry:
+    """
+    Holds every asset in the media directory in memory, one slash command
+    each. The first send uploads the file; after that the command replies
+    with the attachment's CDN link. Links are signed and expire, so a link
+    close to expiry is refreshed by refetching the message it was uploaded
+    in, and the file is uploaded again if that message is gone. Links are
+    keyed by file hash and kept on disk between restarts.
+    An optional media.json in the directory overrides the command name
+    and description per file, e.g.
+        {"boo.gif": {"description": "Booooooo!"}}
+    Parameters:
+        client: discord.Client
+    Optional Parameters:
+        directory: str
+        path: str (link cache file)
+    """
+
+    def __init__(self, client: discord.Client, directory: str = MEDIA_DIR, path: str = "media_urls.json") -> None:
+        self.client = client
+        self.directory = directory
+        self.path = path
+        self.assets: Dict[str, MediaAsset] = {}
+        self._links: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._links = json.load(f)
+
+    def scan(self) -> List[MediaAsset]:
+        """Rereads the media directory into memory and returns its assets"""
+        manifest = {}
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        assets = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.lower().endswith(MEDIA_EXTENSIONS):
+                continue
+            options = manifest.get(filename, {})
+            command = options.get("command") or command_name(filename)
+            description = options.get("description") or f"Send {os.path.splitext(filename)[0]}"
+            if not command or command in assets:
+                continue
+            with open(os.path.join(self.directory, filename), "rb") as f:
+                assets[command] = MediaAsset(filename, command, description[:100], f.read())
+        self.assets = assets
+        return list(assets.values())
+
+    async def send(self, interaction: discord.Interaction, command: str) -> None:
+        asset = self.assets[command]
+        url = await self._revalidate(asset.digest)
+        if url is not None:
+            METRICS.increment("media_sends", mode="link")
+            await interaction.response.send_message(url)
+            return
+        METRICS.increment("media_sends", mode="upload")
+        await interaction.response.send_message(file=discord.File(BytesIO(asset.data), filename=asset.filename))
+        message = await interaction.original_response()
+        if message.attachments:
+            self._remember(asset.digest, message)
+            await asyncio.to_thread(atomicfile.write_json, self.path, dict(self._links))
+
+    async def _revalidate(self, digest: str) -> str:
+        """A working link for the file with this hash, or None if it needs uploading"""
+        link = self._links.get(digest)
+        if link is None:
+            return None
+        if time.time() < link["expires"] - REFRESH_MARGIN:
+            return link["url"]
+        channel = self.client.get_partial_messageable(link["channel_id"])
+        try:
+            message = await channel.fetch_message(link["message_id"])
+        except discord.HTTPException:
+            message = None
+        if message is None or not message.attachments:
+            self._links.pop(digest, None)
+            return None
+        self._remember(digest, message)
+        await asyncio.to_thread(atomicfile.write_json, self.path, dict(self._links))
+        return self._links[digest]["url"]
+
+    def _remember(self, digest: str, message: discord.Message) -> None:
+        url = message.attachments[0].url
+        self._links[digest] = {
+            "url": url,
+            "expires": expiry(url),
+            "channel_id": message.channel.id,
+            "message_id": message.id,
+        }
@@ -0,0 +1,160 @@
+"""
+In-memory latency histograms, counters and gauges, with a Prometheus text export
+"""
+
+import asyncio
+import contextlib
+import time
+import traceback
+from collections import deque
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import atomicfile
+
+WINDOW = 1000
+EXPORT_INTERVAL = 15
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "gnomebot_"
+
+
+def percentile(samples, fraction: float) -> float:
+    """Nearest-rank percentile of samples, 0.0 when there are none"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Histogram:
+    """Rolling window of the most recent samples plus lifetime count and sum"""
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction: float) -> float:
+        return percentile(self.samples, fraction)
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(labels: Tuple, **extra) -> str:
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """
+    Named latency histograms, counters and gauges, each optionally split by labels
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[Tuple, Histogram] = {}
+        self.counters: Dict[Tuple, int] = {}
+        self.gauges: Dict[Tuple, float] = {}
+        self._exporter: asyncio.Task = None
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def increment(self, name: str, amount: int = 1, **labels) -> None:
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Records the current value of something that goes up and down"""
+        self.gauges[_key(name, labels)] = value
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Times a block into name, counting name_errors when it raises. A
+        cancelled block (like the loser of a hedged race) is only counted as
+        name_cancelled, since its duration says nothing about the backend.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.increment(f"{name}_cancelled", **labels)
+            raise
+        except Exception:
+            self.increment(f"{name}_errors", **labels)
+            self.observe(name, time.perf_counter() - start, **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self) -> List[str]:
+        """Human-readable lines for the /stats command"""
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            label = ",".join(v for _, v in labels)
+            p50, p95, p99 = (histogram.quantile(q) for q in QUANTILES)
+            lines.append(
+                f"{name}[{label}] n={histogram.count} p50={p50:.2f}s p95={p95:.2f}s p99={p99:.2f}s"
+            )
+        for (name, labels), value in sorted(self.counters.items()):
+            label = ",".join(v for _, v in labels)
+            lines.append(f"{name}[{label}] {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            label = ",".join(v for _, v in labels)
+            lines.append(f"{name}[{label}] {value:g}")
+        return lines
+
+    def prometheus(self) -> str:
+        lines = []
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                lines.append(f"{metric}{_labels(labels, quantile=q)} {histogram.quantile(q):.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {histogram.total:.6f}")
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = PREFIX + name + "_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def start(self, path: str = "metrics.prom", interval: float = EXPORT_INTERVAL) -> None:
+        """Starts writing the Prometheus text file every interval seconds"""
+        if self._exporter is None or self._exporter.done():
+            self._exporter = asyncio.create_task(self._export(path, interval))
+
+    async def _export(self, path: str, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(atomicfile.write_text, path, self.prometheus())
+            except OSError:
+                traceback.print_exc()
+
+
+METRICS = Metrics()
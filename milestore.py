@@ -0,0 +1,215 @@
+"""
+SQLite-backed log of /miles entries with in-memory totals
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import time
+import traceback
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+FLUSH_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    activity TEXT NOT NULL,
+    distance REAL NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    activity TEXT PRIMARY KEY,
+    distance REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    activity TEXT NOT NULL,
+    distance REAL NOT NULL,
+    PRIMARY KEY (period, bucket, user_id, activity)
+);
+"""
+
+PERIODS = ("week", "month", "year", "all")
+# Entries from the old data.json totals have no user and no real date
+LEGACY_USER = 0
+
+
+def bucket(period: str, ts: float) -> str:
+    """Names the time bucket a timestamp falls in for a rollup period"""
+    day = datetime.datetime.fromtimestamp(ts)
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{day.year}-{day.month:02d}"
+    if period == "year":
+        return str(day.year)
+    return "all"
+
+
+class MilesStore:
+    """
+    Records every /miles entry as (user, activity, distance, timestamp) in a
+    WAL-mode SQLite database. Totals are kept in memory and in an aggregate
+    table, and per-user weekly, monthly, yearly and all-time rollups in a
+    bucket table, all updated in the same transaction as each batch of
+    entries, so leaderboards never scan the raw log. Writes are queued and
+    flushed in batches off the event loop.
+    Optional Parameters:
+        path: str
+        legacy_path: str (old data.json totals, imported once)
+        flush_interval: float
+    """
+
+    def __init__(self, path: str = "miles.db", legacy_path: str = "data.json", flush_interval: float = FLUSH_INTERVAL) -> None:
+        self.path = path
+        self.legacy_path = legacy_path
+        self.flush_interval = flush_interval
+        self._totals: Dict[str, float] = {}
+        self._queue: List[Tuple[int, str, float, float]] = []
+        self._wakeup: asyncio.Event = None
+        self._writer: asyncio.Task = None
+        self._lock = asyncio.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._import_legacy()
+        self._backfill_rollups()
+        # Earlier versions also rolled the legacy totals into the week/month/year they were imported in
+        with self.db:
+            self.db.execute("DELETE FROM rollups WHERE user_id = ? AND period != 'all'", (LEGACY_USER,))
+        self._totals = dict(self.db.execute("SELECT activity, distance FROM totals"))
+
+    def _import_legacy(self) -> None:
+        if not os.path.exists(self.legacy_path):
+            return
+        if self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]:
+            return
+        with open(self.legacy_path, "r") as f:
+            legacy = json.load(f)
+        now = time.time()
+        # The old file only kept group totals, so they become one entry each with no user
+        self._write([(LEGACY_USER, activity, distance, now) for activity, distance in legacy.items() if distance])
+
+    def _backfill_rollups(self) -> None:
+        if self.db.execute("SELECT 1 FROM rollups LIMIT 1").fetchone():
+            return
+        rows = self.db.execute("SELECT user_id, activity, distance, ts FROM entries").fetchall()
+        with self.db:
+            self._roll_up(rows)
+
+    def _roll_up(self, rows: List[Tuple[int, str, float, float]]) -> None:
+        """Adds entries to their buckets; legacy entries only count towards all time"""
+        self.db.executemany(
+            "INSERT INTO rollups (period, bucket, user_id, activity, distance) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(period, bucket, user_id, activity) DO UPDATE SET distance = distance + excluded.distance",
+            [
+                (period, bucket(period, ts), user_id, activity, distance)
+                for user_id, activity, distance, ts in rows
+                for period in PERIODS
+                if user_id != LEGACY_USER or period == "all"
+            ],
+        )
+
+    def _write(self, rows: List[Tuple[int, str, float, float]]) -> None:
+        with self.db:
+            self._roll_up(rows)
+            self.db.executemany(
+                "INSERT INTO entries (user_id, activity, distance, ts) VALUES (?, ?, ?, ?)", rows
+            )
+            self.db.executemany(
+                "INSERT INTO totals (activity, distance) VALUES (?, ?) "
+                "ON CONFLICT(activity) DO UPDATE SET distance = distance + excluded.distance",
+                [(activity, distance) for _, activity, distance, _ in rows],
+            )
+
+    def totals(self) -> Dict[str, float]:
+        return dict(self._totals)
+
+    def add(self, user_id: int, activity: str, distance: float) -> None:
+        """Records an entry; totals update immediately and the row is written on the next flush"""
+        self._totals[activity] = self._totals.get(activity, 0) + distance
+        self._queue.append((user_id, activity, distance, time.time()))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Give a burst of entries a moment to pile up into one transaction
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+                # The batch is back on the queue; try it again next round
+                self._wakeup.set()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            rows, self._queue = self._queue, []
+            if not rows:
+                return
+            write = asyncio.ensure_future(asyncio.to_thread(self._write, rows))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The thread commits whether or not we're cancelled; keep the lock until it has
+                await asyncio.wait([write])
+                if write.exception() is not None:
+                    self._queue = rows + self._queue
+                raise
+            except Exception:
+                # The transaction rolled back, so nothing from the batch landed
+                self._queue = rows + self._queue
+                raise
+
+    def _query(self, sql: str, params: Tuple) -> List[Tuple]:
+        return self.db.execute(sql, params).fetchall()
+
+    async def _read(self, sql: str, params: Tuple) -> List[Tuple]:
+        # Pending entries have to land before the rollups can answer for them
+        await self.flush()
+        async with self._lock:
+            return await asyncio.to_thread(self._query, sql, params)
+
+    async def activity_totals(self, period: str = "all", user_id: int = None) -> Dict[str, float]:
+        """Distance per activity in the current bucket of a period, for everyone or one user"""
+        sql = "SELECT activity, SUM(distance) FROM rollups WHERE period = ? AND bucket = ?"
+        params = (period, bucket(period, time.time()))
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params += (user_id,)
+        return dict(await self._read(sql + " GROUP BY activity", params))
+
+    async def leaderboard(self, period: str = "all", activity: str = None, limit: int = 10) -> List[Tuple[int, float]]:
+        """Top (user_id, distance) pairs in the current bucket of a period"""
+        sql = "SELECT user_id, SUM(distance) AS total FROM rollups WHERE period = ? AND bucket = ? AND user_id != ?"
+        params = (period, bucket(period, time.time()), LEGACY_USER)
+        if activity is not None:
+            sql += " AND activity = ?"
+            params += (activity,)
+        sql += " GROUP BY user_id ORDER BY total DESC LIMIT ?"
+        return await self._read(sql, params + (limit,))
+
+    async def aclose(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        await self.flush()
+        self.db.close()
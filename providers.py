@@ -0,0 +1,181 @@
+"""
+Image providers for /image and hedged racing between them
+"""
+
+import asyncio
+import time
+import traceback
+from base64 import b64decode
+from io import BytesIO
+from typing import Awaitable
+from typing import Callable
+from typing import List
+
+from metrics import METRICS
+
+HEDGE_AFTER = 45.0
+DALLE_MODEL = "dall-e-2"
+DALLE_SIZE = "1024x1024"
+
+
+class ProviderFailed(Exception):
+    """The provider refused or failed the prompt; the message is fit to show the user"""
+
+
+class ProviderUnavailable(Exception):
+    """The provider can't take work right now, so another one should be tried"""
+
+
+class ImageProvider:
+    """
+    Something that turns a prompt into images. generate() returns named
+    BytesIO objects, raises ProviderFailed or ProviderUnavailable, and must
+    tolerate being cancelled at any await.
+    """
+
+    name = "provider"
+
+    async def generate(self, prompt: str, count: int,
+                       progress: Callable[[str], Awaitable[None]] = None) -> List[BytesIO]:
+        raise NotImplementedError
+
+
+class BingProvider(ImageProvider):
+    """
+    Bing Image Creator through the cookie scheduler
+    Parameters:
+        pool: BingImageCreator.ClientPool
+        scheduler: cookies.CookieScheduler
+    Optional Parameters:
+        polling: keyword overrides for BingImageCreator's results polling
+            (timeout, poll_interval, max_poll_interval, poll_backoff, poll_jitter)
+    """
+
+    name = "bing"
+
+    def __init__(self, pool, scheduler, **polling) -> None:
+        self.pool = pool
+        self.scheduler = scheduler
+        self.polling = polling
+
+    async def generate(self, prompt, count, progress=None):
+        import BingImageCreator
+        import httpx
+
+        async def job(cookie):
+            return await BingImageCreator.generate_image(prompt, cookie, count, pool=self.pool, progress=progress, **self.polling)
+
+        try:
+            return await self.scheduler.run(job)
+        except (BingImageCreator.RedirectFailedException, httpx.HTTPError) as e:
+            raise ProviderUnavailable(str(e)) from e
+        except BingImageCreator.ImageCreatorException as e:
+            raise ProviderFailed(str(e)) from e
+
+
+class DalleProvider(ImageProvider):
+    """
+    OpenAI's image API through the shared AsyncOpenAI client. Always asks
+    for a single image, since every requested image is billed even when the
+    race is lost.
+    Parameters:
+        client: openai.AsyncOpenAI
+    Optional Parameters:
+        model: str
+        size: str
+    """
+
+    name = "dalle"
+
+    def __init__(self, client, model: str = DALLE_MODEL, size: str = DALLE_SIZE) -> None:
+        self.client = client
+        self.model = model
+        self.size = size
+
+    async def generate(self, prompt, count, progress=None):
+        import openai
+
+        try:
+            with METRICS.timer("openai_seconds", call="image"):
+                response = await self.client.images.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    size=self.size,
+                    quality="standard",
+                    n=1,
+                    response_format="b64_json",
+                )
+        except openai.BadRequestError as e:
+            body = e.body if isinstance(e.body, dict) else {}
+            raise ProviderFailed(body.get("message", str(e))) from e
+        except openai.OpenAIError as e:
+            raise ProviderUnavailable(str(e)) from e
+        # A 1024x1024 PNG is a couple of megabytes of base64; decode it off the loop
+        data = await asyncio.to_thread(b64decode, response.data[0].b64_json)
+        image = BytesIO(data)
+        image.name = "image.png"
+        return [image]
+
+
+async def _report(progress, stage: str) -> None:
+    if progress is None:
+        return
+    try:
+        await progress(stage)
+    except Exception:
+        traceback.print_exc()
+
+
+async def _timed(provider: ImageProvider, prompt: str, count: int, progress) -> List[BytesIO]:
+    with METRICS.timer("image_provider_seconds", provider=provider.name):
+        return await provider.generate(prompt, count, progress)
+
+
+async def hedged(primary: ImageProvider, fallback: ImageProvider, prompt: str, count: int,
+                 hedge_after: float = HEDGE_AFTER,
+                 progress: Callable[[str], Awaitable[None]] = None) -> List[BytesIO]:
+    """
+    Runs primary, and starts fallback as well once primary has taken
+    hedge_after seconds (never, if None) or straight away if primary is
+    unavailable. Returns whichever succeeds first and cancels the other.
+    If both fail, raises the primary's error unless it was only unavailable.
+    """
+    started = time.monotonic()
+    tasks = {asyncio.ensure_future(_timed(primary, prompt, count, progress)): primary}
+    errors = {}
+    fallback_started = False
+
+    def start_fallback(reason: str) -> None:
+        nonlocal fallback_started
+        fallback_started = True
+        METRICS.increment("image_hedges", reason=reason)
+        tasks[asyncio.ensure_future(_timed(fallback, prompt, count, progress))] = fallback
+
+    try:
+        while tasks:
+            timeout = None
+            if not fallback_started and hedge_after is not None:
+                timeout = max(started + hedge_after - time.monotonic(), 0)
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start_fallback("slow")
+                await _report(progress, "hedging")
+                continue
+            for task in done:
+                provider = tasks.pop(task)
+                error = task.exception()
+                if error is None:
+                    METRICS.increment("image_provider_wins", provider=provider.name)
+                    return task.result()
+                if not isinstance(error, (ProviderFailed, ProviderUnavailable)):
+                    raise error
+                errors[provider] = error
+                if provider is primary and not fallback_started and isinstance(error, ProviderUnavailable):
+                    start_fallback("unavailable")
+        error = errors.get(primary)
+        if not isinstance(error, ProviderFailed):
+            error = errors.get(fallback, error)
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,158 @@
+"""
+Token-bucket rate limits per user, guild and globally for expensive commands
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+import discord
+from discord import app_commands
+
+import atomicfile
+from metrics import METRICS
+
+SAVE_INTERVAL = 60
+SCOPES = ("user", "guild", "global")
+# command -> scope -> (tokens, seconds to refill them all)
+LIMITS = {
+    "respond": {"user": (6, 60), "guild": (20, 60), "global": (60, 60)},
+    "image": {"user": (8, 600), "guild": (24, 600), "global": (60, 600)},
+}
+
+
+class Bucket:
+    """Refills lazily on each use, so an idle bucket costs nothing to keep"""
+
+    def __init__(self, capacity: float, period: float, tokens: float = None, updated: float = None) -> None:
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity if tokens is None else tokens
+        self.updated = time.monotonic() if updated is None else updated
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait(self, cost: float) -> float:
+        """Seconds until cost tokens are available"""
+        return max(cost - self.tokens, 0) / self.rate
+
+
+class RateLimiter:
+    """
+    Per-command token buckets for each user, each guild and everyone
+    together. A call has to afford its cost from all three buckets or none
+    are charged. Full buckets are dropped, so memory only grows with people
+    actually being limited, and partly drained buckets are saved every
+    save_interval seconds so a restart doesn't hand out fresh quotas.
+    Optional Parameters:
+        limits: dict of command -> scope -> (tokens, seconds), merged over LIMITS
+        path: str
+        save_interval: float (seconds)
+    """
+
+    def __init__(self, limits: Dict = None, path: str = "ratelimits.json", save_interval: float = SAVE_INTERVAL) -> None:
+        self.limits: Dict[str, Dict[str, Tuple[float, float]]] = {
+            command: dict(scopes) for command, scopes in LIMITS.items()
+        }
+        for command, scopes in (limits or {}).items():
+            self.limits.setdefault(command, {}).update({scope: tuple(limit) for scope, limit in scopes.items()})
+        self.path = path
+        self.save_interval = save_interval
+        self._buckets: Dict[Tuple[str, str, int], Bucket] = {}
+        self._saver: asyncio.Task = None
+        self._load()
+
+    def _bucket(self, command: str, scope: str, key: int) -> Bucket:
+        bucket = self._buckets.get((command, scope, key))
+        if bucket is None:
+            bucket = self._buckets[(command, scope, key)] = Bucket(*self.limits[command][scope])
+        return bucket
+
+    def acquire(self, command: str, user_id: int, guild_id: int, cost: float = 1) -> Tuple[float, str]:
+        """
+        Charges cost to the command's buckets. Returns (0, None) when allowed,
+        otherwise the seconds to wait and the scope that ran out.
+        """
+        scopes = self.limits.get(command)
+        if not scopes:
+            return 0.0, None
+        keys = {"user": user_id, "guild": guild_id or 0, "global": 0}
+        now = time.monotonic()
+        buckets = {scope: self._bucket(command, scope, keys[scope]) for scope in SCOPES if scope in scopes}
+        waits = {}
+        for scope, bucket in buckets.items():
+            bucket.refill(now)
+            waits[scope] = bucket.wait(min(cost, bucket.capacity))
+        scope = max(waits, key=waits.get)
+        if waits[scope] > 0:
+            METRICS.increment("rate_limited", command=command, scope=scope)
+            return waits[scope], scope
+        for bucket in buckets.values():
+            bucket.tokens -= min(cost, bucket.capacity)
+        return 0.0, None
+
+    def start(self) -> None:
+        if self._saver is None or self._saver.done():
+            self._saver = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await asyncio.to_thread(atomicfile.write_json, self.path, self._snapshot())
+            except OSError:
+                traceback.print_exc()
+
+    def save(self) -> None:
+        atomicfile.write_json(self.path, self._snapshot())
+
+    def _snapshot(self) -> Dict:
+        now = time.monotonic()
+        saved = {}
+        for key, bucket in list(self._buckets.items()):
+            if bucket.refill(now) >= bucket.capacity:
+                del self._buckets[key]
+                continue
+            saved["|".join(map(str, key))] = bucket.tokens
+        return {"saved_at": time.time(), "buckets": saved}
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            snapshot = json.load(f)
+        # Buckets kept refilling while we were down
+        updated = time.monotonic() - max(time.time() - snapshot["saved_at"], 0)
+        for key, tokens in snapshot["buckets"].items():
+            command, scope, owner = key.split("|")
+            if scope not in self.limits.get(command, {}):
+                continue
+            capacity, period = self.limits[command][scope]
+            self._buckets[(command, scope, int(owner))] = Bucket(capacity, period, min(tokens, capacity), updated)
+
+
+def limited(limiter: RateLimiter, command: str, cost: Union[float, Callable[[discord.Interaction], float]] = 1):
+    """
+    Check decorator for app commands that charges cost (or cost(interaction),
+    which can read the options from interaction.namespace) against the
+    command's limits, raising app_commands.CommandOnCooldown when over
+    """
+
+    async def predicate(interaction: discord.Interaction) -> bool:
+        amount = cost(interaction) if callable(cost) else cost
+        retry_after, scope = limiter.acquire(command, interaction.user.id, interaction.guild_id, amount)
+        if retry_after > 0:
+            tokens, period = limiter.limits[command][scope]
+            raise app_commands.CommandOnCooldown(app_commands.Cooldown(tokens, period), retry_after)
+        return True
+
+    return app_commands.check(predicate)
@@ -0,0 +1,127 @@
+"""
+Coalescing error reporter for the debug channels
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+import traceback
+from io import BytesIO
+from typing import Dict
+from typing import List
+
+import discord
+
+WINDOW = 60
+SEND_BUDGET = 20
+BUDGET_PERIOD = 60
+MESSAGE_LIMIT = 2000
+FRAME = re.compile(r'^\s*File "([^"]+)", line \d+, in (.+)$', re.MULTILINE)
+
+
+def fingerprint(trace: str) -> str:
+    """
+    Identifies a traceback by its frames and exception type, ignoring line
+    numbers and the exception message so repeats group even when ids differ
+    """
+    frames = FRAME.findall(trace)
+    lines = trace.strip().splitlines()
+    exception_type = lines[-1].split(":", 1)[0] if lines else ""
+    return hashlib.sha1(repr((frames, exception_type)).encode("utf-8")).hexdigest()[:12]
+
+
+class ErrorGroup:
+    def __init__(self, trace: str) -> None:
+        self.summary = trace.strip().splitlines()[-1] if trace.strip() else "error"
+        self.count = 1
+        self.first_seen = time.monotonic()
+
+
+class ErrorReporter:
+    """
+    Delivers debug messages and tracebacks to every debug channel at once
+    from a background queue. The first occurrence of a traceback is sent
+    straight away; repeats within the window are counted and sent as one
+    "×N" summary when it closes. All channel sends share a token bucket, and
+    messages too long for Discord are attached as a file.
+    Parameters:
+        client: discord.Client
+        channel_ids: list[int]
+    Optional Parameters:
+        window: float (seconds)
+        budget: int (sends per budget_period)
+        budget_period: float (seconds)
+    """
+
+    def __init__(self, client: discord.Client, channel_ids: List[int], window: float = WINDOW,
+                 budget: int = SEND_BUDGET, budget_period: float = BUDGET_PERIOD) -> None:
+        self.client = client
+        self.channel_ids = channel_ids
+        self.window = window
+        self.budget = budget
+        self.budget_period = budget_period
+        self.suppressed = 0
+        self._tokens = float(budget)
+        self._refilled = time.monotonic()
+        self._groups: Dict[str, ErrorGroup] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: asyncio.Task = None
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def send(self, message: str) -> None:
+        self._queue.put_nowait(message)
+
+    def report(self, trace: str) -> None:
+        key = fingerprint(trace)
+        group = self._groups.get(key)
+        if group is not None:
+            group.count += 1
+            self.suppressed += 1
+            return
+        self._groups[key] = ErrorGroup(trace)
+        self.send("```{}```".format(trace))
+        asyncio.get_running_loop().call_later(self.window, self._close, key)
+
+    def _close(self, key: str) -> None:
+        group = self._groups.pop(key, None)
+        if group is not None and group.count > 1:
+            self.send(f"×{group.count - 1} more of `{group.summary}` in the last {self.window:g}s")
+
+    async def _spend(self, tokens: int) -> None:
+        rate = self.budget / self.budget_period
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.budget, self._tokens + (now - self._refilled) * rate)
+            self._refilled = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self._tokens) / rate)
+
+    async def _deliver(self, cid: int, message: str) -> None:
+        channel = self.client.get_channel(cid)
+        if channel is None:
+            return
+        if len(message) <= MESSAGE_LIMIT:
+            await channel.send(message)
+            return
+        text = message.strip("`").strip()
+        header = text.splitlines()[-1][:MESSAGE_LIMIT - 40] if text else "error"
+        attachment = discord.File(BytesIO(text.encode("utf-8")), filename="traceback.txt")
+        await channel.send(f"`{header}` (full trace attached)", file=attachment)
+
+    async def _run(self) -> None:
+        while True:
+            message = await self._queue.get()
+            await self._spend(min(len(self.channel_ids), self.budget))
+            results = await asyncio.gather(
+                *(self._deliver(cid, message) for cid in self.channel_ids),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    traceback.print_exception(type(result), result, result.__traceback__)
@@ -0,0 +1,54 @@
+"""
+Cold start profiling
+"""
+
+import contextlib
+import time
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from metrics import METRICS
+
+
+class StartupProfile:
+    """
+    Times each startup phase in order, from when this module is first
+    imported until the bot is ready, plus subsystems that are loaded later on
+    first use
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: List[Tuple[str, float]] = []
+        self.deferred: Dict[str, float] = {}
+        self.reported = False
+
+    def mark(self, name: str) -> None:
+        """Ends the current phase under name"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @contextlib.contextmanager
+    def deferred_load(self, name: str):
+        """Times a subsystem loaded after startup"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.deferred[name] = self.deferred.get(name, 0.0) + elapsed
+            METRICS.observe("subsystem_load_seconds", elapsed, subsystem=name)
+
+    def report(self) -> str:
+        lines = [f"{name}: {seconds * 1000:.0f}ms" for name, seconds in self.phases]
+        lines.append(f"total: {(self._last - self.started) * 1000:.0f}ms")
+        if self.deferred:
+            loaded = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.deferred.items())
+            lines.append(f"loaded on demand: {loaded}")
+        return "\n".join(lines)
+
+
+PROFILE = StartupProfile()
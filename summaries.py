@@ -0,0 +1,136 @@
+"""
+Rolling per-channel conversation summaries for /respond
+"""
+
+import asyncio
+import json
+import os
+import traceback
+from typing import Dict
+from typing import Tuple
+
+import discord
+
+import atomicfile
+import context
+from metrics import METRICS
+
+REFRESH_AFTER = 40
+KEEP_RECENT = 15
+MAX_BATCH = 200
+SUMMARY_TOKENS = 400
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a Discord group chat so a chat bot can follow along. "
+    "Update the summary with the new messages below. Keep who said what, running jokes, open "
+    "questions and anything people asked the bot to remember. Drop small talk. Answer with the "
+    "updated summary only, in at most 250 words."
+)
+
+
+class ChannelSummaries:
+    """
+    Keeps a compact summary per channel, refreshed in the background once
+    enough messages have arrived past the channel's watermark (the id of the
+    newest summarized message) and persisted to disk between restarts
+    Parameters:
+        get_openai: callable returning the openai.AsyncOpenAI client, called on first refresh
+    Optional Parameters:
+        path: str
+        refresh_after: int (new messages before a refresh)
+        keep_recent: int (newest messages left out of the summary)
+        model: str
+    """
+
+    def __init__(
+        self,
+        get_openai,
+        path: str = "summaries.json",
+        refresh_after: int = REFRESH_AFTER,
+        keep_recent: int = KEEP_RECENT,
+        model: str = "gpt-3.5-turbo",
+    ) -> None:
+        self.get_openai = get_openai
+        self.path = path
+        self.refresh_after = refresh_after
+        self.keep_recent = keep_recent
+        self.model = model
+        self._summaries: Dict[str, Dict] = {}
+        self._pending: Dict[int, int] = {}
+        self._tracked = set()
+        self._queued = set()
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._summaries = json.load(f)
+        self._tracked.update(int(channel_id) for channel_id in self._summaries)
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._queued.clear()
+            self._worker = asyncio.create_task(self._run())
+
+    def get(self, channel_id: int) -> Tuple[str, int]:
+        """Returns (summary, watermark) for a channel, or (None, 0)"""
+        entry = self._summaries.get(str(channel_id))
+        if entry is None:
+            return None, 0
+        return entry["summary"], entry["watermark"]
+
+    def track(self, channel) -> None:
+        """Starts summarizing a channel, queueing its first summary right away"""
+        if channel.id in self._tracked:
+            return
+        self._tracked.add(channel.id)
+        if self._queue is not None:
+            self._queued.add(channel.id)
+            self._queue.put_nowait(channel)
+
+    def note(self, message: discord.Message) -> None:
+        """Counts a new message and queues a refresh once enough have arrived"""
+        channel_id = message.channel.id
+        if channel_id not in self._tracked:
+            return
+        self._pending[channel_id] = self._pending.get(channel_id, 0) + 1
+        if self._queue is None or channel_id in self._queued:
+            return
+        if self._pending[channel_id] >= self.refresh_after + self.keep_recent:
+            self._queued.add(channel_id)
+            self._queue.put_nowait(message.channel)
+
+    async def _run(self) -> None:
+        while True:
+            channel = await self._queue.get()
+            try:
+                await self.refresh(channel)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queued.discard(channel.id)
+
+    async def refresh(self, channel) -> None:
+        summary, watermark = self.get(channel.id)
+        after = discord.Object(id=watermark) if watermark else None
+        fetched = [m async for m in channel.history(limit=MAX_BATCH, after=after, oldest_first=after is not None)]
+        fetched.sort(key=lambda m: m.id)
+        new = fetched[:-self.keep_recent] if self.keep_recent else fetched
+        if not new:
+            return
+        lines = "\n".join(context.trim(context.format_message(m), context.MAX_MESSAGE_TOKENS) for m in new)
+        request = f"Current summary:\n{summary or '(none yet)'}\n\nNew messages:\n{lines}"
+        with METRICS.timer("openai_seconds", call="summary"):
+            response = await self.get_openai().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": request},
+                ],
+                max_tokens=SUMMARY_TOKENS,
+            )
+        updated = response.choices[0].message.content
+        if not updated:
+            return
+        self._summaries[str(channel.id)] = {"summary": updated.strip(), "watermark": new[-1].id}
+        self._pending[channel.id] = len(fetched) - len(new)
+        await asyncio.to_thread(atomicfile.write_json, self.path, dict(self._summaries))
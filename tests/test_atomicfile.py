@@ -0,0 +1,24 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import atomicfile
+
+
+def test_concurrent_writers_never_share_a_temp_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: atomicfile.write_json(path, {"writer": i, "padding": "x" * 100000}), range(64)))
+    with open(path) as f:
+        assert json.load(f)["writer"] in range(64)
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+
+def test_failed_write_leaves_the_old_file(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text('{"old": true}')
+    try:
+        atomicfile.write_text(str(path), 123)
+    except TypeError:
+        pass
+    assert json.loads(path.read_text()) == {"old": True}
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
@@ -0,0 +1,21 @@
+import sys
+import types
+
+import context
+
+
+def test_encoding_falls_back_once_when_tiktoken_cannot_load(monkeypatch):
+    calls = []
+
+    def get_encoding(name):
+        calls.append(name)
+        raise ConnectionError("no network")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    context.encoding.cache_clear()
+    try:
+        assert context.count_tokens("x" * 40) == 10
+        assert context.count_tokens("y" * 8) == 2
+        assert calls == ["cl100k_base"]
+    finally:
+        context.encoding.cache_clear()
@@ -0,0 +1,54 @@
+import asyncio
+
+import history
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.messages = []
+
+    def post(self, message_id):
+        message = FakeMessage(message_id, self)
+        self.messages.append(message)
+        return message
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=False):
+        messages = [
+            m for m in reversed(self.messages)
+            if (before is None or m.id < before.id) and (after is None or m.id > after.id)
+        ]
+        for message in messages[:limit]:
+            yield message
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+
+
+async def collect(iterator):
+    return [m.id async for m in iterator]
+
+
+def test_whole_channel_after_buffer_overflows():
+    channel = FakeChannel(1)
+    buffer = history.MessageBuffer(size=20)
+    for i in range(1, 11):
+        channel.post(i)
+    assert asyncio.run(collect(buffer.iter_recent(channel, None))) == list(range(10, 0, -1))
+    for i in range(11, 60):
+        buffer.add(channel.post(i))
+    assert asyncio.run(collect(buffer.iter_recent(channel, None))) == list(range(59, 0, -1))
+
+
+def test_small_channel_is_served_from_the_buffer():
+    channel = FakeChannel(1)
+    buffer = history.MessageBuffer(size=20)
+    for i in range(1, 6):
+        channel.post(i)
+    asyncio.run(collect(buffer.iter_recent(channel, None)))
+    buffer.add(channel.post(6))
+    channel.messages.clear()
+    assert asyncio.run(collect(buffer.iter_recent(channel, None))) == [6, 5, 4, 3, 2, 1]
@@ -0,0 +1,40 @@
+import asyncio
+import os
+from io import BytesIO
+
+import imagecache
+
+
+def images(*bodies):
+    files = []
+    for i, body in enumerate(bodies):
+        image = BytesIO(body)
+        image.name = f"{i}.png"
+        files.append(image)
+    return files
+
+
+def test_concurrent_puts_for_one_prompt_are_counted_once(tmp_path):
+    cache = imagecache.ImageCache(str(tmp_path))
+
+    async def scenario():
+        await asyncio.gather(*(cache.put("a gnome", 2, images(b"x" * 10, b"y" * 10)) for _ in range(4)))
+        return await cache.get("a gnome", 2)
+
+    cached = asyncio.run(scenario())
+    assert [image.getvalue() for image in cached] == [b"x" * 10, b"y" * 10]
+    assert cache.total_bytes == 20
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_failed_write_is_not_indexed(tmp_path):
+    cache = imagecache.ImageCache(str(tmp_path))
+    # A directory the index doesn't know about blocks the rename
+    os.makedirs(tmp_path / imagecache.cache_key("a gnome", 1) / "stale")
+
+    async def scenario():
+        await cache.put("a gnome", 1, images(b"x" * 10))
+        return await cache.get("a gnome", 1)
+
+    assert asyncio.run(scenario()) is None
+    assert cache.total_bytes == 0
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+import jobqueue
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Worker:
+    """Jobs that record when they start and finish only when released"""
+
+    def __init__(self):
+        self.started = []
+        self.gates = {}
+
+    def job(self, label):
+        async def run():
+            self.started.append(label)
+            self.gates[label] = asyncio.Event()
+            await self.gates[label].wait()
+            return label
+        return run
+
+    async def finish(self, label):
+        await settle()
+        self.gates[label].set()
+        await settle()
+
+    async def drain(self, queue):
+        while queue.running or queue.depth:
+            for gate in self.gates.values():
+                gate.set()
+            await settle()
+
+
+def test_user_served_immediately_waits_for_the_next_round():
+    async def scenario():
+        queue = jobqueue.JobQueue(concurrency=1)
+        worker = Worker()
+        queue.submit(1, 10, worker.job("1a"))
+        await settle()
+        queue.submit(1, 10, worker.job("1b"))
+        queue.submit(1, 10, worker.job("1c"))
+        queue.submit(2, 10, worker.job("2a"))
+        for label in ("1a", "2a", "1b"):
+            await worker.finish(label)
+        await worker.finish("1c")
+        return worker.started
+
+    assert asyncio.run(scenario()) == ["1a", "2a", "1b", "1c"]
+
+
+def test_round_robin_across_guilds_then_users():
+    async def scenario():
+        queue = jobqueue.JobQueue(concurrency=1, max_per_user=5)
+        worker = Worker()
+        queue.submit(1, 10, worker.job("blocker"))
+        await settle()
+        for label, user, guild in (("g10u1", 1, 10), ("g10u1b", 1, 10), ("g10u2", 2, 10), ("g20u3", 3, 20)):
+            queue.submit(user, guild, worker.job(label))
+        expected = [job for job in queue.order()]
+        for label in ("blocker", "g20u3", "g10u2", "g10u1"):
+            await worker.finish(label)
+        return worker.started, [job.user_id for job in expected]
+
+    started, order = asyncio.run(scenario())
+    # Guild 10 was just served, so guild 20 goes first; user 1 was just served within guild 10
+    assert order == [3, 2, 1, 1]
+    assert started == ["blocker", "g20u3", "g10u2", "g10u1", "g10u1b"]
+
+
+def test_positions_are_reported_as_the_line_moves():
+    async def scenario():
+        queue = jobqueue.JobQueue(concurrency=1)
+        worker = Worker()
+        positions = []
+
+        async def on_position(place):
+            positions.append(place)
+
+        queue.submit(1, 10, worker.job("first"))
+        queue.submit(2, 10, worker.job("second"))
+        queue.submit(3, 10, worker.job("third"), on_position=on_position)
+        await settle()
+        await worker.finish("first")
+        await worker.finish("second")
+        stats = queue.stats()
+        await worker.drain(queue)
+        return positions, stats
+
+    positions, stats = asyncio.run(scenario())
+    assert positions == [2, 1]
+    assert stats["depth"] == 0 and stats["running"] == 1
+
+
+def test_cancel_waiting_and_running_jobs():
+    async def scenario():
+        queue = jobqueue.JobQueue(concurrency=1)
+        worker = Worker()
+        running = queue.submit(1, 10, worker.job("running"))
+        waiting = queue.submit(2, 10, worker.job("waiting"))
+        last = queue.submit(3, 10, worker.job("last"))
+        await settle()
+        assert queue.cancel(waiting)
+        with pytest.raises(jobqueue.JobCancelled):
+            await waiting
+        assert not queue.cancel(waiting)
+        assert last.position == 1
+        assert queue.cancel(running)
+        with pytest.raises(jobqueue.JobCancelled):
+            await running
+        await settle()
+        await worker.finish("last")
+        assert await last == "last"
+        assert not queue.cancel(last)
+        return worker.started, queue.stats()
+
+    started, stats = asyncio.run(scenario())
+    assert started == ["running", "last"]
+    assert stats["cancelled"] == 2 and stats["completed"] == 1
+
+
+def test_limits():
+    async def scenario():
+        queue = jobqueue.JobQueue(concurrency=1, max_queued=2, max_per_user=2)
+        worker = Worker()
+        queue.submit(1, 10, worker.job("a"))
+        queue.submit(1, 10, worker.job("b"))
+        with pytest.raises(jobqueue.QueueFull):
+            queue.submit(1, 10, worker.job("c"))
+        queue.submit(2, 10, worker.job("d"))
+        with pytest.raises(jobqueue.QueueFull):
+            queue.submit(3, 10, worker.job("e"))
+        await worker.drain(queue)
+
+    asyncio.run(scenario())
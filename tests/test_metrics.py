@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from metrics import Metrics
+
+
+def test_timer_records_successes_and_errors():
+    metrics = Metrics()
+    with metrics.timer("call", backend="a"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer("call", backend="a"):
+            raise ValueError()
+    assert metrics.histograms[("call", (("backend", "a"),))].count == 2
+    assert metrics.counters == {("call_errors", (("backend", "a"),)): 1}
+
+
+def test_timer_keeps_cancelled_blocks_out_of_errors_and_latency():
+    metrics = Metrics()
+
+    async def slow():
+        with metrics.timer("call", backend="a"):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        task = asyncio.ensure_future(slow())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert metrics.histograms == {}
+    assert metrics.counters == {("call_cancelled", (("backend", "a"),)): 1}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+
+import milestore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_store(tmp_path, legacy=None):
+    legacy_path = tmp_path / "data.json"
+    if legacy is not None:
+        legacy_path.write_text(json.dumps(legacy))
+    return milestore.MilesStore(str(tmp_path / "miles.db"), legacy_path=str(legacy_path), flush_interval=0)
+
+
+def test_legacy_totals_only_count_towards_all_time(tmp_path):
+    store = make_store(tmp_path, {"Walking": 120.5, "Running": 300})
+
+    async def scenario():
+        store.add(1, "Running", 3)
+        return {period: await store.activity_totals(period) for period in milestore.PERIODS}
+
+    totals = run(scenario())
+    assert totals["week"] == {"Running": 3.0}
+    assert totals["month"] == {"Running": 3.0}
+    assert totals["year"] == {"Running": 3.0}
+    assert totals["all"] == {"Running": 303.0, "Walking": 120.5}
+    assert store.totals() == {"Running": 303.0, "Walking": 120.5}
+    run(store.aclose())
+
+
+def test_polluted_rollups_are_cleaned_on_open(tmp_path):
+    store = make_store(tmp_path, {"Walking": 120.5})
+    with store.db:
+        store.db.execute(
+            "INSERT INTO rollups VALUES ('week', ?, 0, 'Walking', 120.5)",
+            (milestore.bucket("week", 0),),
+        )
+    store.db.close()
+
+    store = make_store(tmp_path)
+    rows = store.db.execute("SELECT period FROM rollups WHERE user_id = 0").fetchall()
+    assert rows == [("all",)]
+    run(store.aclose())
+
+
+def test_leaderboard_skips_legacy_entries(tmp_path):
+    store = make_store(tmp_path, {"Walking": 120.5})
+
+    async def scenario():
+        store.add(1, "Walking", 2)
+        store.add(2, "Walking", 5)
+        return await store.leaderboard("all")
+
+    assert run(scenario()) == [(2, 5.0), (1, 2.0)]
+    run(store.aclose())
+
+
+def fail_first_write(store):
+    write = store._write
+    failures = []
+
+    def flaky(rows):
+        if not failures:
+            failures.append(rows)
+            raise milestore.sqlite3.OperationalError("database is locked")
+        write(rows)
+
+    store._write = flaky
+    return failures
+
+
+def test_failed_flush_keeps_the_batch(tmp_path):
+    store = make_store(tmp_path)
+    failures = fail_first_write(store)
+
+    async def scenario():
+        store.add(1, "Running", 3)
+        try:
+            await store.flush()
+        except milestore.sqlite3.OperationalError:
+            pass
+        store.add(1, "Running", 2)
+        return await store.activity_totals("all", user_id=1)
+
+    assert run(scenario()) == {"Running": 5.0}
+    assert failures == [[(1, "Running", 3, failures[0][0][3])]]
+    assert store.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 2
+    run(store.aclose())
+
+
+def test_writer_survives_a_failed_flush(tmp_path):
+    store = make_store(tmp_path)
+    failures = fail_first_write(store)
+
+    async def scenario():
+        store.start()
+        store.add(1, "Running", 3)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not store._queue:
+                break
+        return store._writer.done()
+
+    assert run(scenario()) is False
+    assert failures
+    assert store.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 1
+    run(store.aclose())
+
+
+def test_cancelled_flush_writes_the_batch_once(tmp_path):
+    store = make_store(tmp_path)
+    write = store._write
+
+    def slow(rows):
+        time.sleep(0.2)
+        write(rows)
+
+    store._write = slow
+
+    async def scenario():
+        store.add(1, "Running", 3)
+        flush = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        await store.flush()
+        return await store.activity_totals("all", user_id=1)
+
+    assert run(scenario()) == {"Running": 3.0}
+    assert store.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 1
+    run(store.aclose())